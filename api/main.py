@@ -1,16 +1,70 @@
 # api/main.py
 
-from fastapi import FastAPI, HTTPException
+import asyncio
+import os
+import random
+import re
+import time
+import uuid
+import zlib
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, MutableHeaders
 from pydantic import BaseModel
+from typing import List
 import uvicorn
-from src.db import supabase
+from src.db import get_async_backend, close_async_backend, USER_FIELDS, ROOM_FIELDS, MESSAGE_FIELDS
+from src.blobs import BlobTooLarge, parse_range
+from src.bus import create_event_bus
+from src.events import EPOCH, RoomBroker
+from src.ratelimit import RateLimitExceeded
+from src.streaming import MultipartFile, decode_ndjson, dumps, encode_ndjson, gzip_chunks
+from src import config, metrics, profiling
 
 # ------------------ Import from src ------------------
-from src.logic import UserManager, ChatRoomManager, MessageManager, UserStatusManager
+from src.logic import (
+    UserManager, ChatRoomManager, MessageManager, UserStatusManager, InboxManager, AttachmentManager, idempotent_message_id
+)
+
+# Optional speedup: Brotli compression
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+class FastJSONResponse(JSONResponse):
+    """Compact JSON, encoded with orjson when it is installed."""
+
+    def render(self, content):
+        return dumps(content)
+
+NDJSON = "application/x-ndjson"
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose endpoint marks where the logic phase of a profiled request starts and ends."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiling.timed_endpoint(endpoint), **kwargs)
 
 # ------------------ App Setup ------------------
-app = FastAPI(title="Web Talk API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await bus.start()
+    status.start()
+    yield
+    await status.aclose()
+    await messages.aclose()
+    await bus.aclose()
+    await close_async_backend()
+
+app = FastAPI(title="Web Talk API", version="1.0.0", lifespan=lifespan, default_response_class=FastJSONResponse)
+if config.PROFILING_ENABLED:
+    app.router.route_class = ProfiledRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,11 +74,298 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves paths matching `excluded_handlers` alone, as BrotliMiddleware does."""
+
+    def __init__(self, app, excluded_handlers=(), **kwargs):
+        super().__init__(app, **kwargs)
+        self.excluded_handlers = [re.compile(pattern) for pattern in excluded_handlers]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and any(pattern.search(scope["path"]) for pattern in self.excluded_handlers):
+            return await self.app(scope, receive, send)
+        await super().__call__(scope, receive, send)
+
+# Attachment downloads are sent as stored: ranges index the stored bytes and
+# the server may send the file itself
+if BrotliMiddleware is not None:
+    # Brotli for clients that accept it, gzip for the rest
+    # Exports choose their own compression (GZipMiddleware skips application/gzip by itself)
+    app.add_middleware(
+        BrotliMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE, gzip_fallback=True,
+        excluded_handlers=[r"/export$", r"^/attachments/"]
+    )
+else:
+    app.add_middleware(SelectiveGZipMiddleware, minimum_size=config.COMPRESSION_MIN_SIZE, excluded_handlers=[r"^/attachments/"])
+
+# ------------------ Profiling ------------------
+class ProfilingMiddleware:
+    """Profiles requests sent with PROFILE_HEADER, plus a PROFILE_SAMPLE_RATE share of all requests.
+
+    The response gets a Server-Timing header splitting the time into
+    validation, logic, db and serialization, and an X-Profile-File header
+    naming the folded-stack profile written to PROFILE_DIR
+    (fetch it from GET /profiles/{name}).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.header = config.PROFILE_HEADER.lower().encode()
+
+    def _wanted(self, scope):
+        if config.PROFILE_SAMPLE_RATE and random.random() < config.PROFILE_SAMPLE_RATE:
+            return True
+        return any(name == self.header for name, _ in scope["headers"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            return await self.app(scope, receive, send)
+        profile = profiling.RequestProfile()
+        sampler = profiling.StackSampler(asyncio.current_task(), config.PROFILE_INTERVAL_MS / 1000).start()
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.folded"
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                profile.response_started = time.perf_counter()
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", profile.server_timing())
+                headers.append("X-Profile-File", name)
+            await send(message)
+
+        token = profiling.current.set(profile)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            profiling.current.reset(token)
+            await asyncio.to_thread(sampler.stop)
+            await asyncio.to_thread(profiling.write_profile, config.PROFILE_DIR, name, sampler.folded())
+
+if config.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+# ------------------ Metrics ------------------
+HTTP_REQUEST_SECONDS = metrics.registry.histogram(
+    "webtalk_http_request_duration_seconds", "Time to answer an HTTP request, body included.", ("method", "route")
+)
+HTTP_RESPONSES = metrics.registry.counter(
+    "webtalk_http_responses_total", "HTTP responses sent.", ("method", "route", "status")
+)
+HTTP_IN_FLIGHT = metrics.registry.gauge("webtalk_http_requests_in_flight", "HTTP requests being answered.")
+
+class MetricsMiddleware:
+    """Records latency, status code and in-flight count of every HTTP request.
+
+    Plain ASGI rather than BaseHTTPMiddleware, so it adds no task or body
+    copy per request. Requests are labelled by route template
+    (/messages/{room_id}), never by raw path, to keep the series bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._series = {}       # (method, route, status) -> (histogram series, counter series)
+        self._templates = None  # endpoint -> route template, for Starlette without scope["route"]
+
+    def _template(self, scope):
+        route = scope.get("route")
+        if route is not None:
+            return getattr(route, "path", "unmatched")
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._templates is None:
+            self._templates = {r.endpoint: r.path for r in scope["app"].routes if hasattr(r, "endpoint")}
+        return self._templates.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            key = (scope["method"], self._template(scope), status_code)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = (
+                    HTTP_REQUEST_SECONDS.labels(key[0], key[1]), HTTP_RESPONSES.labels(key[0], key[1], str(status_code))
+                )
+            series[0].observe(elapsed)
+            series[1].inc()
+
+if config.METRICS_ENABLED:
+    # Added last so it is the outermost middleware and its timings include compression
+    app.add_middleware(MetricsMiddleware)
+
 # ------------------ Managers ------------------
-users = UserManager()
-rooms = ChatRoomManager()
-messages = MessageManager()
-status = UserStatusManager()
+backend = get_async_backend()
+bus = create_event_bus(config.EVENT_BUS_URL, config.EVENT_BUS_CHANNEL, config.EVENT_BUS_QUEUE_SIZE)
+broker = RoomBroker(config.WS_SEND_QUEUE_SIZE, bus=bus)
+users = UserManager(backend)
+status = UserStatusManager(backend, broker=broker, users=users)
+rooms = ChatRoomManager(backend, statuses=status)
+messages = MessageManager(backend, broker=broker)
+inbox = InboxManager(backend, broker=broker)
+attachments = AttachmentManager(backend, broker=broker)
+
+metrics.registry.add_collector(metrics.cache_collector({
+    "users": users.cache, "rooms": rooms.cache, "message_buffer": messages.buffer, "attachments": attachments.cache
+}))
+
+def send_limit_metrics():
+    limiter = messages.limiter
+    yield ("webtalk_send_rejected_total", "counter", "Message sends refused, by the limit that refused them.",
+           [({"scope": scope}, count) for scope, count in limiter.rejected.items()])
+    yield ("webtalk_send_write_latency_seconds", "gauge", "Moving average of message insert latency, decayed while idle.",
+           [({}, limiter.current_latency())])
+    yield ("webtalk_send_in_flight", "gauge", "Message inserts in progress.", [({}, limiter.in_flight)])
+
+metrics.registry.add_collector(send_limit_metrics)
+
+def event_bus_metrics():
+    stats = bus.stats()
+    if not stats:
+        return
+    yield ("webtalk_event_bus_events_total", "counter", "Events sent to or received from other processes.",
+           [({"outcome": outcome}, stats[outcome]) for outcome in ("published", "received", "dropped")])
+    yield ("webtalk_event_bus_reconnects_total", "counter", "Event bus connections re-established.",
+           [({}, stats["reconnects"])])
+    yield ("webtalk_event_bus_resyncs_total", "counter", "Times in-memory state was dropped because events may have been lost.",
+           [({}, stats["resyncs"])])
+    yield ("webtalk_event_bus_queued", "gauge", "Events waiting to be published.", [({}, stats["queued"])])
+
+metrics.registry.add_collector(event_bus_metrics)
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    return FastJSONResponse(
+        {"Success": False, "Message": str(exc), "limit": exc.scope, "retry_after": round(exc.retry_after, 3)},
+        status_code=429,
+        headers={"Retry-After": exc.retry_after_header},
+    )
+
+# ------------------ Conditional GET ------------------
+def list_etag(name, version, variant=""):
+    # The time window makes tags expire so writes from other processes show up;
+    # every query string (projection, page) is a different representation
+    window = int(time.time() // config.LIST_ETAG_MAX_AGE)
+    variant = f"-{zlib.crc32(variant.encode()):08x}" if variant else ""
+    return f'W/"{name}{variant}-{EPOCH}-{version}-{window}"'
+
+def is_not_modified(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+def parse_expand(expand, allowed):
+    """Split a comma-separated expand= value, rejecting unknown names with a 400."""
+    names = {name.strip() for name in (expand or "").split(",") if name.strip()}
+    unknown = names - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown expand value(s): {', '.join(sorted(unknown))}")
+    return names
+
+def parse_fields(fields, allowed):
+    """Split a comma-separated fields= value, rejecting unknown columns with a 400."""
+    names = list(dict.fromkeys(name.strip() for name in (fields or "").split(",") if name.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown field(s): {', '.join(unknown)}")
+    return names or None
+
+def parse_message_id(message_id):
+    """Normalize a client-chosen message id, rejecting anything but a UUID with a 400."""
+    if message_id is None:
+        return None
+    try:
+        return str(uuid.UUID(message_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Message id must be a UUID: {message_id!r}")
+
+# ------------------ Attachment Downloads ------------------
+def content_disposition(filename):
+    if not filename:
+        return "attachment"
+    fallback = re.sub(r'[^\x20-\x7e]|["\\]', "_", filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+def clean_filename(filename):
+    """The last path component of a client-supplied name, without control characters."""
+    if not filename:
+        return None
+    filename = re.sub(r"[\x00-\x1f\x7f]", "", filename.replace("\\", "/").rsplit("/", 1)[-1]).strip()
+    return filename[:255] or None
+
+class BlobResponse(Response):
+    """An attachment body, honouring single Range requests and If-Range.
+
+    When the server supports the ASGI zerocopysend extension (any range) or
+    pathsend (whole body), the file is handed to it and the bytes never pass
+    through Python. Otherwise they are read on a worker thread,
+    ATTACHMENT_CHUNK_SIZE at a time, so memory stays flat whatever the size.
+    """
+
+    def __init__(self, store, attachment, etag):
+        self.store = store
+        self.key = attachment["sha256"]
+        self.size = attachment["size"]
+        self.etag = etag
+        self.status_code = 200
+        self.media_type = attachment.get("content_type") or "application/octet-stream"
+        self.background = None
+        self.init_headers({
+            "ETag": etag,
+            "Accept-Ranges": "bytes",
+            "Cache-Control": "private, max-age=86400",
+            "Content-Disposition": content_disposition(attachment.get("filename")),
+            "X-Content-Type-Options": "nosniff",
+        })
+
+    async def __call__(self, scope, receive, send):
+        request_headers = Headers(scope=scope)
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if if_range is not None and if_range.strip() != self.etag:
+            range_header = None  # the client holds another version: send it whole
+        try:
+            span = parse_range(range_header, self.size)
+        except ValueError:
+            response = PlainTextResponse("Range not satisfiable", status_code=416, headers={"Content-Range": f"bytes */{self.size}"})
+            return await response(scope, receive, send)
+        start, end = span or (0, self.size)
+        self.headers["content-length"] = str(end - start)
+        if span is not None:
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{self.size}"
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+
+        extensions = scope.get("extensions") or {}
+        path = self.store.local_path(self.key)
+        if scope["method"] == "HEAD" or start == end:
+            await send({"type": "http.response.body", "body": b""})
+        elif path and "http.response.zerocopysend" in extensions:
+            f = await asyncio.to_thread(open, path, "rb")
+            try:
+                await send({"type": "http.response.zerocopysend", "file": f, "offset": start, "count": end - start})
+            finally:
+                f.close()
+        elif path and span is None and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": path})
+        else:
+            async for chunk in self.store.iter_range(self.key, start, end, config.ATTACHMENT_CHUNK_SIZE):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
 
 # ------------------ Pydantic Models ------------------
 class UserCreate(BaseModel):
@@ -44,12 +385,23 @@ class ChatRoomCreate(BaseModel):
     created_by: str
     is_private: bool = False
 
+class RoomMembersUpdate(BaseModel):
+    user_ids: List[str]
+
+class RoomRead(BaseModel):
+    user_id: str
+
 class MessageCreate(BaseModel):
     room_id: str
     sender_id: str
     content: str
     message_type: str = "text"
     reply_to_id: str = None
+    # Optional client-generated UUID; resending the same id never creates a second message
+    id: str = None
+
+class MessageBatch(BaseModel):
+    messages: List[MessageCreate]
 
 class MessageUpdate(BaseModel):
     content: str
@@ -60,8 +412,8 @@ class UserStatusUpdate(BaseModel):
 
 # ------------------ USER Endpoints ------------------
 @app.post("/users")
-def create_user_endpoint(user: UserCreate):
-    return users.create_user(
+async def create_user_endpoint(user: UserCreate):
+    return await users.create_user(
         username=user.username,
         full_name=user.full_name,
         email=user.email,
@@ -69,78 +421,308 @@ def create_user_endpoint(user: UserCreate):
     )
 
 @app.get("/users/{user_id}")
-def get_user_by_id_endpoint(user_id: str):
-    return users.get_user_by_id(user_id)
+async def get_user_by_id_endpoint(user_id: str):
+    return await users.get_user_by_id(user_id)
 
 @app.put("/users/{user_id}")
-def update_user_endpoint(user_id: str, updates: UserUpdate):
-    return users.update_user(user_id, updates.dict(exclude_unset=True))
+async def update_user_endpoint(user_id: str, updates: UserUpdate):
+    return await users.update_user(user_id, updates.dict(exclude_unset=True))
 
 @app.delete("/users/{user_id}")
-def delete_user_endpoint(user_id: str):
-    return users.delete_user(user_id)
+async def delete_user_endpoint(user_id: str):
+    return await users.delete_user(user_id)
+
+@app.get("/users/{user_id}/rooms")
+async def get_rooms_for_user_endpoint(
+    user_id: str,
+    expand: str = Query(None, description="'room' to embed each room"),
+    limit: int = Query(None, ge=1, le=1000),
+    cursor: str = Query(None, description="next_cursor of the previous page"),
+):
+    return await rooms.get_rooms_for_user(user_id, parse_expand(expand, {"room"}), limit, cursor)
+
+@app.get("/users/{user_id}/search")
+async def search_user_messages_endpoint(
+    user_id: str,
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, description="next_offset of the previous page"),
+):
+    return await messages.search_user_messages(user_id, q, limit, offset)
+
+@app.get("/users/{user_id}/inbox")
+async def get_inbox_endpoint(user_id: str):
+    return await inbox.get_inbox(user_id)
 
 @app.get("/users")
-def get_all_users():
-    return users.list_users()
+async def get_all_users(
+    request: Request,
+    fields: str = Query(None, description="Comma-separated columns to return"),
+    limit: int = Query(None, ge=1, le=config.LIST_PAGE_MAX),
+    cursor: str = Query(None, description="next_cursor of the previous page"),
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$", description="'ndjson' streams every user, one per line"),
+):
+    fields = parse_fields(fields, USER_FIELDS)
+    if output == "ndjson":
+        return StreamingResponse(encode_ndjson(users.iter_users(fields)), media_type=NDJSON)
+    etag = list_etag("users", users.version, request.url.query)
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    result = await users.list_users(fields, limit, cursor)
+    if result.get("Success"):
+        return FastJSONResponse(result, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return FastJSONResponse(result)
 
 
 # ------------------ CHAT ROOM Endpoints ------------------
 @app.post("/rooms")
-def create_chat_room_endpoint(room: ChatRoomCreate):
-    return rooms.create_chat_room(room.name, room.created_by, room.is_private)
+async def create_chat_room_endpoint(room: ChatRoomCreate):
+    return await rooms.create_chat_room(room.name, room.created_by, room.is_private)
 
 @app.get("/rooms")
-def list_chat_rooms_endpoint():
-    return rooms.list_chat_rooms()
+async def list_chat_rooms_endpoint(
+    request: Request,
+    fields: str = Query(None, description="Comma-separated columns to return"),
+    limit: int = Query(None, ge=1, le=config.LIST_PAGE_MAX),
+    cursor: str = Query(None, description="next_cursor of the previous page"),
+    output: str = Query("json", alias="format", pattern="^(json|ndjson)$", description="'ndjson' streams every room, one per line"),
+):
+    fields = parse_fields(fields, ROOM_FIELDS)
+    if output == "ndjson":
+        return StreamingResponse(encode_ndjson(rooms.iter_chat_rooms(fields)), media_type=NDJSON)
+    etag = list_etag("rooms", rooms.version, request.url.query)
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    result = await rooms.list_chat_rooms(fields, limit, cursor)
+    if "data" in result:
+        return FastJSONResponse(result, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return FastJSONResponse(result)
 
 @app.get("/rooms/{room_id}")
-def get_chat_room_by_id_endpoint(room_id: str):
-    return rooms.get_chat_room_by_id(room_id)
+async def get_chat_room_by_id_endpoint(room_id: str):
+    return await rooms.get_chat_room_by_id(room_id)
 
 @app.delete("/rooms/{room_id}")
-def delete_chat_room_endpoint(room_id: str):
-    return rooms.delete_chat_room(room_id)
+async def delete_chat_room_endpoint(room_id: str):
+    result = await rooms.delete_chat_room(room_id)
+    if result.get("Success"):
+        messages.forget_room(room_id)
+    return result
 
 @app.post("/rooms/{room_id}/add_user/{user_id}")
-def add_user_to_room_endpoint(room_id: str, user_id: str):
-    return rooms.add_user_to_room(user_id, room_id)
+async def add_user_to_room_endpoint(room_id: str, user_id: str):
+    return await rooms.add_user_to_room(user_id, room_id)
 
 @app.post("/rooms/{room_id}/remove_user/{user_id}")
-def remove_user_from_room_endpoint(room_id: str, user_id: str):
-    return rooms.remove_user_from_room(user_id, room_id)
+async def remove_user_from_room_endpoint(room_id: str, user_id: str):
+    return await rooms.remove_user_from_room(user_id, room_id)
+
+@app.post("/rooms/{room_id}/add_users")
+async def add_users_to_room_endpoint(room_id: str, members: RoomMembersUpdate):
+    return await rooms.add_users_to_room(members.user_ids, room_id)
+
+@app.post("/rooms/{room_id}/remove_users")
+async def remove_users_from_room_endpoint(room_id: str, members: RoomMembersUpdate):
+    return await rooms.remove_users_from_room(members.user_ids, room_id)
+
+@app.get("/rooms/{room_id}/export")
+async def export_room_endpoint(
+    room_id: str,
+    compress: str = Query(None, pattern="^gzip$", description="'gzip' for a .ndjson.gz download"),
+):
+    """Whole message history of a room as NDJSON, oldest first."""
+    room = await rooms.get_chat_room_by_id(room_id)
+    if not room.get("data"):
+        raise HTTPException(status_code=404, detail=room.get("Message") or "Room not found")
+    body = encode_ndjson(messages.iter_room_messages(room_id))
+    filename = f"room-{room_id}.ndjson"
+    if compress == "gzip":
+        body, media_type, filename = gzip_chunks(body), "application/gzip", filename + ".gz"
+    else:
+        media_type = NDJSON
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.post("/rooms/{room_id}/import")
+async def import_room_endpoint(room_id: str, request: Request):
+    """Bulk-load messages from an NDJSON request body (plain or gzip), as produced by export."""
+    room = await rooms.get_chat_room_by_id(room_id)
+    if not room.get("data"):
+        raise HTTPException(status_code=404, detail=room.get("Message") or "Room not found")
+    compressed = True if request.headers.get("content-encoding", "").lower() == "gzip" else None
+    documents = decode_ndjson(request.stream(), compressed, config.IMPORT_MAX_LINE_BYTES)
+    return await messages.import_messages(room_id, documents)
+
+@app.post("/rooms/{room_id}/read")
+async def mark_room_read_endpoint(room_id: str, data: RoomRead):
+    return await inbox.mark_room_read(data.user_id, room_id)
+
+@app.get("/rooms/{room_id}/search")
+async def search_room_messages_endpoint(
+    room_id: str,
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, description="next_offset of the previous page"),
+):
+    return await messages.search_messages([room_id], q, limit, offset)
 
 @app.get("/rooms/{room_id}/users")
-def get_users_in_room_endpoint(room_id: str):
-    return rooms.get_users_in_room(room_id)
+async def get_users_in_room_endpoint(
+    room_id: str,
+    expand: str = Query(None, description="Comma-separated: 'profile', 'presence'"),
+    limit: int = Query(None, ge=1, le=1000),
+    cursor: str = Query(None, description="next_cursor of the previous page"),
+):
+    return await rooms.get_users_in_room(room_id, parse_expand(expand, {"profile", "presence"}), limit, cursor)
 
 # ------------------ MESSAGE Endpoints ------------------
 @app.post("/messages")
-def send_message_endpoint(msg: MessageCreate):
-    return messages.send_message(
-        msg.room_id, msg.sender_id, msg.content, msg.message_type, msg.reply_to_id
+async def send_message_endpoint(
+    msg: MessageCreate,
+    idempotency_key: str = Header(None, alias="Idempotency-Key", description="Used as the message id when the body has none"),
+):
+    message_id = parse_message_id(msg.id)
+    if message_id is None and idempotency_key:
+        message_id = idempotent_message_id(msg.sender_id, idempotency_key)
+    return await messages.send_message(
+        msg.room_id, msg.sender_id, msg.content, msg.message_type, msg.reply_to_id, message_id
     )
 
+@app.post("/messages/batch")
+async def send_messages_batch_endpoint(batch: MessageBatch):
+    return await messages.send_messages([{**msg.dict(), "id": parse_message_id(msg.id)} for msg in batch.messages])
+
 @app.get("/messages/{room_id}")
-def get_messages_for_room_endpoint(room_id: str, limit: int = 50, offset: int = 0):
-    return messages.get_messages_for_room(room_id, limit, offset)
+async def get_messages_for_room_endpoint(
+    room_id: str,
+    limit: int = Query(50, ge=1),
+    before: str = Query(None, description="Cursor: return messages older than this one"),
+    after: str = Query(None, description="Cursor: return messages newer than this one"),
+    offset: int = Query(0, ge=0, deprecated=True, description="Use 'before' with next_cursor instead"),
+    fields: str = Query(None, description="Comma-separated columns to return"),
+):
+    fields = parse_fields(fields, MESSAGE_FIELDS)
+    # Returned as a response object so the rows skip FastAPI's jsonable_encoder pass
+    return FastJSONResponse(await messages.get_messages_for_room(room_id, limit, offset, before, after, fields))
+
+@app.get("/messages/{room_id}/changes")
+async def get_message_changes_endpoint(room_id: str, since: str = None):
+    return await messages.get_changes(room_id, since)
 
 @app.put("/messages/{message_id}")
-def edit_message_endpoint(message_id: str, updates: MessageUpdate):
-    return messages.edit_message(message_id, updates.content)
+async def edit_message_endpoint(message_id: str, updates: MessageUpdate):
+    return await messages.edit_message(message_id, updates.content)
 
 @app.delete("/messages/{message_id}")
-def delete_message_endpoint(message_id: str):
-    return messages.delete_message(message_id)
+async def delete_message_endpoint(message_id: str):
+    return await messages.delete_message(message_id)
+
+# ------------------ ATTACHMENT Endpoints ------------------
+@app.post("/messages/{message_id}/attachments")
+async def upload_attachment_endpoint(
+    request: Request,
+    message_id: str,
+    filename: str = Query(None, description="Name to download the file as"),
+):
+    """Attach a file to a message: either the raw request body (its Content-Type
+    is kept) or the first file of a multipart/form-data body. Both are streamed
+    into the blob store as they arrive."""
+    content_type = request.headers.get("content-type") or ""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > config.ATTACHMENT_MAX_BYTES + config.ATTACHMENT_FORM_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"Attachment is larger than {config.ATTACHMENT_MAX_BYTES} bytes")
+    chunks = request.stream()
+    if content_type.startswith("multipart/form-data"):
+        try:
+            chunks = MultipartFile(chunks, content_type, config.ATTACHMENT_FORM_OVERHEAD)
+            if not await chunks.open():
+                raise HTTPException(status_code=400, detail="The form has no file")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        content_type, filename = chunks.content_type, filename or chunks.filename
+    try:
+        return await attachments.upload(message_id, chunks, content_type, clean_filename(filename))
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+@app.get("/messages/{message_id}/attachments")
+async def get_message_attachments_endpoint(message_id: str):
+    return await attachments.get_attachments_for_message(message_id)
+
+@app.api_route("/attachments/{attachment_id}", methods=["GET", "HEAD"])
+async def download_attachment_endpoint(request: Request, attachment_id: str):
+    result = await attachments.get_attachment(attachment_id)
+    attachment = result.get("data")
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    # Blobs are named by their hash, so it is a strong validator for this body
+    etag = f'"{attachment["sha256"]}"'
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    if await attachments.store.size(attachment["sha256"]) is None:
+        raise HTTPException(status_code=404, detail="Attachment body is missing")
+    return BlobResponse(attachments.store, attachment, etag)
+
+# ------------------ REAL-TIME Endpoints ------------------
+@app.websocket("/ws/rooms/{room_id}")
+async def room_events_websocket(websocket: WebSocket, room_id: str):
+    """Streams message.created / message.updated / message.deleted events of a room."""
+    await websocket.accept()
+    subscription = broker.subscribe(room_id)
+
+    async def send_events():
+        while True:
+            payload = await subscription.get()
+            if payload is None:
+                # Fell too far behind; the client should refetch history and reconnect
+                await websocket.close(code=1013, reason="Subscriber too slow")
+                return
+            await websocket.send_text(payload)
+
+    async def wait_for_disconnect():
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    sender = asyncio.create_task(send_events())
+    receiver = asyncio.create_task(wait_for_disconnect())
+    try:
+        await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        broker.unsubscribe(subscription)
+        for task in (sender, receiver):
+            task.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
 
 # ------------------ USER STATUS Endpoints ------------------
 @app.post("/status")
-def update_user_status_endpoint(data: UserStatusUpdate):
-    return status.update_user_status(data.user_id, data.status)
+async def update_user_status_endpoint(data: UserStatusUpdate):
+    return await status.update_user_status(data.user_id, data.status)
+
+@app.get("/status")
+async def get_user_statuses_endpoint(ids: str = Query(..., description="Comma-separated user ids")):
+    return await status.get_user_statuses([user_id.strip() for user_id in ids.split(",") if user_id.strip()])
 
 @app.get("/status/{user_id}")
-def get_user_status_endpoint(user_id: str):
-    return status.get_user_status(user_id)
+async def get_user_status_endpoint(user_id: str):
+    return await status.get_user_status(user_id)
+
+# ------------------ METRICS Endpoint ------------------
+if config.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        """Prometheus text format: HTTP, database call and cache metrics of this process."""
+        return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+# ------------------ PROFILES Endpoint ------------------
+if config.PROFILING_ENABLED:
+    @app.get("/profiles/{name}", include_in_schema=False)
+    async def get_profile_endpoint(name: str):
+        """A folded-stack profile named by an X-Profile-File header."""
+        if not re.fullmatch(r"[\w-]+\.folded", name):
+            raise HTTPException(status_code=404, detail="Profile not found")
+        path = os.path.join(config.PROFILE_DIR, name)
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return FileResponse(path, media_type="text/plain; charset=utf-8")
 
 # ------------------ Run with Uvicorn ------------------
 if __name__ == "__main__":
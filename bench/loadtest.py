@@ -0,0 +1,330 @@
+# bench/loadtest.py
+"""Load test for the Web Talk API.
+
+Starts the API with uvicorn against a throwaway SQLite database (or targets
+a running server with --url), seeds users, rooms, memberships and message
+history, then drives a mixed workload at each concurrency level and prints
+per-endpoint throughput and p50/p95/p99 latency as JSON.
+
+    python -m bench.loadtest --concurrency 1 8 32 --duration 10 --output run.json
+
+Two runs can be compared with --compare old.json new.json. Needs httpx:
+pip install -r bench/requirements.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Share of requests per operation in the mixed workload
+DEFAULT_MIX = {
+    "send": 30,
+    "history": 30,
+    "history_older": 10,
+    "status": 15,
+    "inbox": 5,
+    "list_users": 5,
+    "list_rooms": 5,
+}
+
+# Settings of the started API unless --env overrides them. Send limits are
+# policy, not cost: with them on, sends past the per-sender budget measure the
+# limiter rather than the API
+SERVER_ENV = {
+    "SEND_RATE_PER_SENDER": "0",
+    "SEND_RATE_PER_ROOM": "0",
+    "SEND_LATENCY_THRESHOLD_MS": "0",
+    "SEND_MAX_IN_FLIGHT": "0",
+}
+
+
+# ---------------- SERVER ----------------
+def start_server(port, db_path, extra_env):
+    env = {**os.environ, "DB_BACKEND": "sqlite", "SQLITE_PATH": db_path, **extra_env}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL
+    )
+
+async def wait_until_ready(client, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/rooms")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API did not become ready")
+
+
+# ---------------- SEEDING ----------------
+async def gather_limited(coroutines, limit=32):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+    return await asyncio.gather(*(run(c) for c in coroutines))
+
+async def seed(client, rng, users, rooms, members_per_room, messages_per_room):
+    tag = f"{int(time.time())}{rng.randrange(10**6)}"
+
+    async def create_user(i):
+        response = await client.post("/users", json={
+            "username": f"bench_{tag}_{i}", "full_name": f"Bench User {i}", "email": f"bench{i}@example.com"
+        })
+        return response.json()["user_id"]
+    user_ids = await gather_limited(create_user(i) for i in range(users))
+
+    async def create_room(i):
+        response = await client.post("/rooms", json={"name": f"bench-{tag}-{i}", "created_by": user_ids[i % len(user_ids)]})
+        return response.json()["room_id"]
+    room_ids = await gather_limited(create_room(i) for i in range(rooms))
+
+    members = {}
+    for room_id in room_ids:
+        members[room_id] = rng.sample(user_ids, min(members_per_room, len(user_ids)))
+        await client.post(f"/rooms/{room_id}/add_users", json={"user_ids": members[room_id]})
+
+    words = "hello deploy release lunch review merge ship weekend meeting coffee bug fix".split()
+    for room_id in room_ids:
+        for start in range(0, messages_per_room, 1000):
+            batch = [{
+                "room_id": room_id,
+                "sender_id": rng.choice(members[room_id]),
+                "content": " ".join(rng.choices(words, k=rng.randint(3, 15))),
+            } for _ in range(min(1000, messages_per_room - start))]
+            await client.post("/messages/batch", json={"messages": batch})
+    return {"users": user_ids, "rooms": room_ids, "members": members, "words": words}
+
+
+# ---------------- WORKLOAD ----------------
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rate_limited = defaultdict(int)   # 429s, also counted in errors
+
+    async def call(self, label, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response, failed = None, True
+        self.latencies[label].append(time.perf_counter() - started)
+        if failed:
+            self.errors[label] += 1
+            if response is not None and response.status_code == 429:
+                self.rate_limited[label] += 1
+        return response
+
+async def run_operation(client, recorder, rng, data, operation):
+    room_id = rng.choice(data["rooms"])
+    if operation == "send":
+        await recorder.call("POST /messages", client.post("/messages", json={
+            "room_id": room_id,
+            "sender_id": rng.choice(data["members"][room_id]),
+            "content": " ".join(rng.choices(data["words"], k=rng.randint(3, 15))),
+        }))
+    elif operation == "history":
+        await recorder.call("GET /messages/{room_id}", client.get(f"/messages/{room_id}", params={"limit": 50}))
+    elif operation == "history_older":
+        response = await recorder.call("GET /messages/{room_id}", client.get(f"/messages/{room_id}", params={"limit": 50}))
+        cursor = response.json().get("next_cursor") if response is not None and response.status_code == 200 else None
+        if cursor:
+            await recorder.call("GET /messages/{room_id}?before", client.get(
+                f"/messages/{room_id}", params={"limit": 50, "before": cursor}
+            ))
+    elif operation == "status":
+        await recorder.call("POST /status", client.post("/status", json={
+            "user_id": rng.choice(data["users"]), "status": rng.choice(["online", "away", "busy"])
+        }))
+    elif operation == "inbox":
+        await recorder.call("GET /users/{user_id}/inbox", client.get(f"/users/{rng.choice(data['members'][room_id])}/inbox"))
+    elif operation == "list_users":
+        await recorder.call("GET /users?limit", client.get("/users", params={"limit": 100}))
+    elif operation == "list_rooms":
+        await recorder.call("GET /rooms", client.get("/rooms"))
+
+async def run_level(client, data, concurrency, duration, mix, seed_value):
+    recorder = Recorder()
+    operations, weights = zip(*mix.items())
+    deadline = time.perf_counter() + duration
+
+    async def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        while time.perf_counter() < deadline:
+            await run_operation(client, recorder, rng, data, rng.choices(operations, weights)[0])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return summarize(recorder, concurrency, elapsed)
+
+
+# ---------------- REPORTING ----------------
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(recorder, concurrency, elapsed):
+    endpoints = {}
+    total = 0
+    for label, values in sorted(recorder.latencies.items()):
+        values.sort()
+        total += len(values)
+        endpoints[label] = {
+            "requests": len(values),
+            "errors": recorder.errors[label],
+            "rate_limited": recorder.rate_limited[label],
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "requests": total,
+        "errors": sum(recorder.errors.values()),
+        "rate_limited": sum(recorder.rate_limited.values()),
+        "throughput_rps": round(total / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_path, new_path):
+    """p50/p99 and throughput of two saved runs side by side, per level and endpoint."""
+    with open(old_path) as f:
+        old = {level["concurrency"]: level for level in json.load(f)["levels"]}
+    with open(new_path) as f:
+        new = {level["concurrency"]: level for level in json.load(f)["levels"]}
+    rows = []
+    for concurrency in sorted(old.keys() & new.keys()):
+        for label in sorted(old[concurrency]["endpoints"].keys() & new[concurrency]["endpoints"].keys()):
+            a, b = old[concurrency]["endpoints"][label], new[concurrency]["endpoints"][label]
+            rows.append({
+                "concurrency": concurrency,
+                "endpoint": label,
+                "p50_ms": [a["p50_ms"], b["p50_ms"]],
+                "p99_ms": [a["p99_ms"], b["p99_ms"]],
+                "throughput_rps": [a["throughput_rps"], b["throughput_rps"]],
+                "p50_change": round(b["p50_ms"] / a["p50_ms"] - 1, 3) if a["p50_ms"] else None,
+            })
+    return rows
+
+
+# ---------------- MAIN ----------------
+async def main(args):
+    mix = dict(DEFAULT_MIX)
+    for item in args.mix or ():
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown operation in --mix: {name}")
+        mix[name] = float(weight)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+
+    server = None
+    db_dir = None
+    base_url = args.url
+    env = None
+    if base_url is None:
+        db_dir = tempfile.TemporaryDirectory(prefix="webtalk-bench-")
+        env = {**SERVER_ENV, **dict(item.split("=", 1) for item in args.env or ())}
+        server = start_server(args.port, os.path.join(db_dir.name, "bench.db"), env)
+        base_url = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 8, max_keepalive_connections=max(args.concurrency) + 8)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+            await wait_until_ready(client)
+            rng = random.Random(args.seed)
+            started = time.perf_counter()
+            data = await seed(client, rng, args.users, args.rooms, args.members_per_room, args.messages_per_room)
+            seed_seconds = time.perf_counter() - started
+            if args.warmup:
+                await run_level(client, data, max(args.concurrency), args.warmup, mix, args.seed)
+            levels = []
+            for concurrency in args.concurrency:
+                levels.append(await run_level(client, data, concurrency, args.duration, mix, args.seed))
+                print(f"concurrency {concurrency}: {levels[-1]['throughput_rps']} req/s", file=sys.stderr)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if db_dir is not None:
+            db_dir.cleanup()
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.url or "local uvicorn + sqlite",
+            # Settings given to the started API (send limits off unless overridden); None with --url
+            "server_env": env,
+            "seed": args.seed,
+            "seed_seconds": round(seed_seconds, 3),
+            "dataset": {
+                "users": args.users,
+                "rooms": args.rooms,
+                "members_per_room": args.members_per_room,
+                "messages_per_room": args.messages_per_room,
+            },
+            "mix": mix,
+            "duration_s": args.duration,
+        },
+        "levels": levels,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="Benchmark a running API instead of starting one")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the API started by the benchmark")
+    parser.add_argument("--env", nargs="*", metavar="NAME=VALUE",
+                        help="Extra settings for the started API (send limits are off unless set here)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of unmeasured load before the first level")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--members-per-room", type=int, default=20)
+    parser.add_argument("--messages-per-room", type=int, default=500)
+    parser.add_argument("--mix", nargs="*", metavar="OPERATION=WEIGHT",
+                        help=f"Override workload weights; operations: {', '.join(DEFAULT_MIX)}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two saved reports and exit")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = compare(*args.compare) if args.compare else asyncio.run(main(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -2,9 +2,12 @@
 
 import streamlit as st
 import requests
+import html
 import json
 
 BASE_URL = "http://127.0.0.1:8000"
+# Seconds the user and room lists are reused across reruns before being revalidated
+LIST_CACHE_TTL = 15
 
 # ------------------ PAGE CONFIG ------------------
 st.set_page_config(page_title="💬 Web Talk App", layout="wide")
@@ -99,6 +102,29 @@ st.markdown(f"""
 # ------------------ TITLE ------------------
 st.title("💬 Web Talk")
 
+# ------------------ HTTP SESSION ------------------
+@st.cache_resource
+def _http_adapter():
+    # One keep-alive connection pool shared by every browser session (urllib3 pools are thread-safe)
+    return requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+
+def get_session():
+    # A Session (cookies, headers) per browser session, all sending through the shared pool
+    if "http_session" not in st.session_state:
+        http = requests.Session()
+        adapter = _http_adapter()
+        http.mount("http://", adapter)
+        http.mount("https://", adapter)
+        st.session_state.http_session = http
+    return st.session_state.http_session
+
+@st.cache_resource
+def _etag_store():
+    # path -> (ETag, data) of the last full list response, for If-None-Match
+    return {}
+
+session = get_session()
+
 # ------------------ UTILITIES ------------------
 def handle_response(response):
     try:
@@ -113,39 +139,107 @@ def handle_response(response):
         st.error(data.get("detail") or data.get("Message") or "❌ Something went wrong")
         return None
 
+def _get_list(path):
+    """GET a list endpoint, revalidating the last copy with its ETag. Raises on failure."""
+    store = _etag_store()
+    etag, cached = store.get(path, (None, None))
+    headers = {"If-None-Match": etag} if etag else {}
+    response = session.get(f"{BASE_URL}{path}", headers=headers)
+    if response.status_code == 304 and cached is not None:
+        return cached
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.status_code}")
+    data = response.json()
+    if "ETag" in response.headers:
+        store[path] = (response.headers["ETag"], data)
+    return data
+
+def _index(items, key):
+    # First item wins on duplicate keys, as with a first-match scan
+    index = {}
+    for item in items:
+        index.setdefault(item.get(key), item)
+    return index
+
+def _user_directory(users_list):
+    return {"list": users_list, "by_id": _index(users_list, "id"), "by_username": _index(users_list, "username")}
+
+def _room_directory(rooms_list):
+    return {"list": rooms_list, "by_id": _index(rooms_list, "id"), "by_name": _index(rooms_list, "name")}
+
+# Lookups are built once per load and cached with the list
+@st.cache_data(ttl=LIST_CACHE_TTL, show_spinner=False)
+def _load_users():
+    data = _get_list("/users")
+    return _user_directory(data.get("data") or data.get("users") or [])
+
+@st.cache_data(ttl=LIST_CACHE_TTL, show_spinner=False)
+def _load_rooms():
+    return _room_directory(_get_list("/rooms").get("data", []))
+
+def invalidate_users():
+    _load_users.clear()
+
+def invalidate_rooms():
+    _load_rooms.clear()
+
 def fetch_users():
+    """{"list": users, "by_id": {id: user}, "by_username": {username: user}}"""
     try:
-        response = requests.get(f"{BASE_URL}/users")
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("data") or data.get("users") or []
-        else:
-            st.error(f"❌ Failed to fetch users: {response.status_code}")
-            return []
+        return _load_users()
+    except RuntimeError as e:
+        st.error(f"❌ Failed to fetch users: {e}")
     except Exception as e:
         st.error(f"❌ Error connecting to backend: {e}")
-        return []
+    return _user_directory([])
 
 def fetch_rooms():
+    """{"list": rooms, "by_id": {id: room}, "by_name": {name: room}}"""
     try:
-        response = requests.get(f"{BASE_URL}/rooms")
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("data", [])
-        else:
-            st.error(f"❌ Failed to fetch rooms: {response.status_code}")
-            return []
+        return _load_rooms()
+    except RuntimeError as e:
+        st.error(f"❌ Failed to fetch rooms: {e}")
     except Exception as e:
         st.error(f"❌ Error connecting to backend: {e}")
-        return []
+    return _room_directory([])
+
+def lookup_id(index, key):
+    item = index.get(key)
+    return item["id"] if item else None
+
+def resolve_senders(message_list, users, room_id):
+    """sender_id -> display name for a page of messages.
+
+    Senders missing from the cached user list (e.g. created since it was
+    loaded) are resolved with one member listing of the room.
+    """
+    sender_ids = {msg["sender_id"] for msg in message_list if msg.get("sender_id")}
+    names = {user_id: users["by_id"][user_id]["username"] for user_id in sender_ids if user_id in users["by_id"]}
+    if len(names) < len(sender_ids):
+        response = session.get(f"{BASE_URL}/rooms/{room_id}/users", params={"expand": "profile"})
+        if response.status_code == 200:
+            for member in response.json().get("data") or []:
+                if member.get("user") and member["user_id"] in sender_ids:
+                    names.setdefault(member["user_id"], member["user"]["username"])
+    return names
+
+def render_messages(message_list, names):
+    # One markdown element for the whole page instead of one per message
+    blocks = [
+        f'<div class="fetched-msg">[{html.escape(names.get(msg["sender_id"]) or str(msg["sender_id"]))}] '
+        f'{html.escape(msg["content"])}</div>'
+        for msg in message_list
+    ]
+    if blocks:
+        st.markdown("".join(blocks), unsafe_allow_html=True)
 
 # ------------------ USER MANAGEMENT ------------------
 def user_management():
     st.header("👤 User Management")
     tab1, tab2, tab3 = st.tabs(["➕ Create", "🔍 Get", "⚙️ Update/Delete"])
 
-    users_list = fetch_users()
-    usernames = [u["username"] for u in users_list]
+    users = fetch_users()
+    usernames = [u["username"] for u in users["list"]]
 
     # CREATE USER
     with tab1:
@@ -158,8 +252,9 @@ def user_management():
                 st.warning("⚠️ Username and Full Name are required!")
             else:
                 data = {"username": username, "full_name": full_name, "email": email, "avatar_url": avatar_url}
-                response = requests.post(f"{BASE_URL}/users", json=data)
-                handle_response(response)
+                response = session.post(f"{BASE_URL}/users", json=data)
+                if handle_response(response):
+                    invalidate_users()
 
     # GET USER
     with tab2:
@@ -168,9 +263,9 @@ def user_management():
         else:
             user_selection = st.selectbox("Select User to Fetch", usernames)
             if st.button("Get User"):
-                user_id = next((u["id"] for u in users_list if u["username"] == user_selection), None)
+                user_id = lookup_id(users["by_username"], user_selection)
                 if user_id:
-                    response = requests.get(f"{BASE_URL}/users/{user_id}")
+                    response = session.get(f"{BASE_URL}/users/{user_id}")
                     st.json(response.json())
                 else:
                     st.error("❌ User not found.")
@@ -181,12 +276,15 @@ def user_management():
             st.info("⚠️ No users found. Please create one first.")
         else:
             user_selection = st.selectbox("Select User to Update/Delete", usernames)
-            user_id = next((u["id"] for u in users_list if u["username"] == user_selection), None)
+            user_id = lookup_id(users["by_username"], user_selection)
 
             if st.button("Delete User"):
                 if user_id:
-                    response = requests.delete(f"{BASE_URL}/users/{user_id}")
-                    handle_response(response)
+                    response = session.delete(f"{BASE_URL}/users/{user_id}")
+                    if handle_response(response):
+                        # Rooms the user created lose their creator
+                        invalidate_users()
+                        invalidate_rooms()
                 else:
                     st.error("❌ User not found.")
 
@@ -199,8 +297,9 @@ def user_management():
                     try:
                         update_data = json.loads(updates)
                         if user_id:
-                            response = requests.put(f"{BASE_URL}/users/{user_id}", json=update_data)
-                            handle_response(response)
+                            response = session.put(f"{BASE_URL}/users/{user_id}", json=update_data)
+                            if handle_response(response):
+                                invalidate_users()
                         else:
                             st.error("❌ User not found.")
                     except json.JSONDecodeError:
@@ -209,10 +308,10 @@ def user_management():
 # ------------------ CHAT ROOM MANAGEMENT ------------------
 def chat_room_management():
     st.header("💬 Chat Room Management")
-    rooms_list = fetch_rooms()
-    rooms_names = [r["name"] for r in rooms_list]
-    users_list = fetch_users()
-    usernames = [u["username"] for u in users_list]
+    rooms = fetch_rooms()
+    rooms_names = [r["name"] for r in rooms["list"]]
+    users = fetch_users()
+    usernames = [u["username"] for u in users["list"]]
 
     with st.form("create_room_form"):
         room_name = st.text_input("Room Name")
@@ -221,36 +320,44 @@ def chat_room_management():
             if not usernames:
                 st.warning("⚠️ No users available. Please create a user first.")
             else:
-                creator_id = next((u["id"] for u in users_list if u["username"] == creator_name), None)
+                creator_id = lookup_id(users["by_username"], creator_name)
                 if not creator_id:
                     st.error("❌ Creator not found.")
                 else:
                     data = {"name": room_name, "created_by": creator_id}
-                    response = requests.post(f"{BASE_URL}/rooms", json=data)
-                    handle_response(response)
+                    response = session.post(f"{BASE_URL}/rooms", json=data)
+                    if handle_response(response):
+                        invalidate_rooms()
 
     with st.form("add_user_form"):
         room_name_sel = st.selectbox("Select Room", rooms_names if rooms_names else ["No rooms available"])
-        username_sel = st.selectbox("Select User to Add", usernames if usernames else ["No users available"])
-        if st.form_submit_button("Add User to Room"):
+        usernames_sel = st.multiselect("Select Users to Add", usernames)
+        if st.form_submit_button("Add Users to Room"):
             if not rooms_names or not usernames:
                 st.warning("⚠️ You need at least one room and one user.")
+            elif not usernames_sel:
+                st.warning("⚠️ Select at least one user.")
             else:
-                room_id = next((r["id"] for r in rooms_list if r["name"] == room_name_sel), None)
-                user_id = next((u["id"] for u in users_list if u["username"] == username_sel), None)
-                if room_id and user_id:
-                    response = requests.post(f"{BASE_URL}/rooms/{room_id}/add_user/{user_id}")
-                    handle_response(response)
+                room_id = lookup_id(rooms["by_name"], room_name_sel)
+                user_ids = [lookup_id(users["by_username"], name) for name in usernames_sel]
+                user_ids = [user_id for user_id in user_ids if user_id]
+                if room_id and user_ids:
+                    response = session.post(f"{BASE_URL}/rooms/{room_id}/add_users", json={"user_ids": user_ids})
+                    data = handle_response(response)
+                    if data:
+                        skipped = [r for r in data.get("results", []) if r["status"] != "added"]
+                        if skipped:
+                            st.info(f"ℹ️ {len(skipped)} selected users were already members or not found.")
                 else:
                     st.error("❌ Room or User not found.")
 
 # ------------------ MESSAGE MANAGEMENT ------------------
 def message_management():
     st.header("✉️ Messages")
-    users_list = fetch_users()
-    usernames = [u["username"] for u in users_list]
-    rooms_list = fetch_rooms()
-    rooms_names = [r["name"] for r in rooms_list]
+    users = fetch_users()
+    usernames = [u["username"] for u in users["list"]]
+    rooms = fetch_rooms()
+    rooms_names = [r["name"] for r in rooms["list"]]
 
     with st.form("send_message_form"):
         room_name = st.selectbox("Room", rooms_names if rooms_names else ["No rooms available"])
@@ -260,11 +367,11 @@ def message_management():
             if not rooms_names or not usernames:
                 st.warning("⚠️ Room or user list is empty.")
             else:
-                room_id = next((r["id"] for r in rooms_list if r["name"] == room_name), None)
-                sender_id = next((u["id"] for u in users_list if u["username"] == sender_name), None)
+                room_id = lookup_id(rooms["by_name"], room_name)
+                sender_id = lookup_id(users["by_username"], sender_name)
                 if room_id and sender_id:
                     data = {"room_id": room_id, "sender_id": sender_id, "content": content}
-                    response = requests.post(f"{BASE_URL}/messages", json=data)
+                    response = session.post(f"{BASE_URL}/messages", json=data)
                     handle_response(response)
                 else:
                     st.error("❌ Room or Sender not found.")
@@ -272,16 +379,22 @@ def message_management():
     st.markdown("### 📩 Fetch Messages")
     room_name = st.selectbox("Select Room to Fetch Messages", rooms_names if rooms_names else ["No rooms available"])
     limit = st.number_input("Limit", value=10, min_value=1)
-    offset = st.number_input("Offset", value=0, min_value=0)
-    if st.button("Fetch Messages"):
-        room_id = next((r["id"] for r in rooms_list if r["name"] == room_name), None)
+    room_id = lookup_id(rooms["by_name"], room_name)
+    # next_cursor of the last page fetched for this room, used by "Load Older Messages"
+    cursor_room, cursor = st.session_state.get("messages_cursor", (None, None))
+    fetch_clicked = st.button("Fetch Messages")
+    older_clicked = bool(cursor) and cursor_room == room_id and st.button("Load Older Messages")
+    if fetch_clicked or older_clicked:
         if room_id:
-            response = requests.get(f"{BASE_URL}/messages/{room_id}?limit={limit}&offset={offset}")
+            params = {"limit": limit}
+            if older_clicked:
+                params["before"] = cursor
+            response = session.get(f"{BASE_URL}/messages/{room_id}", params=params)
             if response.status_code == 200:
                 messages = response.json()
-                for msg in messages.get("data", []):
-                    sender_name = next((u["username"] for u in users_list if u["id"] == msg["sender_id"]), msg["sender_id"])
-                    st.markdown(f'<div class="fetched-msg">[{sender_name}] {msg["content"]}</div>', unsafe_allow_html=True)
+                st.session_state["messages_cursor"] = (room_id, messages.get("next_cursor"))
+                message_list = messages.get("data", [])
+                render_messages(message_list, resolve_senders(message_list, users, room_id))
             else:
                 handle_response(response)
         else:
@@ -290,8 +403,8 @@ def message_management():
 # ------------------ USER STATUS ------------------
 def status_management():
     st.header("📶 User Status")
-    users_list = fetch_users()
-    usernames = [u["username"] for u in users_list]
+    users = fetch_users()
+    usernames = [u["username"] for u in users["list"]]
 
     if not usernames:
         st.info("⚠️ No users available. Create one first.")
@@ -300,19 +413,19 @@ def status_management():
     user_name_sel = st.selectbox("Select User", usernames)
     status_val = st.selectbox("Status", ["online", "offline", "busy", "away"])
     if st.button("Update Status"):
-        user_id = next((u["id"] for u in users_list if u["username"] == user_name_sel), None)
+        user_id = lookup_id(users["by_username"], user_name_sel)
         if user_id:
             data = {"user_id": user_id, "status": status_val}
-            response = requests.post(f"{BASE_URL}/status", json=data)
+            response = session.post(f"{BASE_URL}/status", json=data)
             handle_response(response)
         else:
             st.error("❌ User not found.")
 
     user_name_sel2 = st.selectbox("Select User to Fetch Status", usernames)
     if st.button("Get Status"):
-        user_id = next((u["id"] for u in users_list if u["username"] == user_name_sel2), None)
+        user_id = lookup_id(users["by_username"], user_name_sel2)
         if user_id:
-            response = requests.get(f"{BASE_URL}/status/{user_id}")
+            response = session.get(f"{BASE_URL}/status/{user_id}")
             if response.status_code == 200:
                 st.write(f"📡 User Status: {response.json().get('status')}")
             else:
@@ -0,0 +1,71 @@
+# src/batching.py
+import asyncio
+
+
+class WriteBehindQueue:
+    """Coalesces concurrent writes into batches.
+
+    submit() parks the caller until its item has been written. Items arriving
+    within `window` seconds of each other (or until `max_batch` are waiting)
+    are handed to `flush` together, and flushes run one at a time in arrival
+    order, so items are written in the order they were submitted.
+
+    `flush(items)` is a coroutine returning one result per item, in order.
+    """
+
+    def __init__(self, flush, window=0.005, max_batch=500):
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._lock = asyncio.Lock()
+        self._tasks = set()
+
+    async def submit(self, item):
+        return (await self.submit_many([item]))[0]
+
+    async def submit_many(self, items):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            self._pending.append((item, future))
+            futures.append(future)
+            if len(self._pending) >= self.max_batch:
+                self._start_flush()
+        if self._pending and self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return await asyncio.gather(*futures)
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._write(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, batch):
+        async with self._lock:
+            try:
+                results = await self.flush([item for item, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+        if len(results) != len(batch):
+            results = [RuntimeError(f"flush returned {len(results)} results for {len(batch)} items")] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def drain(self):
+        """Write everything still queued; call before shutdown."""
+        self._start_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,174 @@
+# src/blobs.py
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+
+
+class BlobTooLarge(ValueError):
+    """An upload went over the size limit; nothing was stored."""
+
+
+class BlobStore:
+    """Content-addressed storage for attachment bodies.
+
+    Blobs are named by the sha256 of their bytes, so the same file uploaded
+    twice is stored once. put() consumes an async iterator of byte chunks and
+    never holds more than one write buffer of it in memory.
+    """
+
+    async def put(self, chunks, max_bytes=None):
+        """Store a stream; returns (sha256 hex, size, created), created False when the blob already existed."""
+        raise NotImplementedError
+
+    async def size(self, key):
+        """Size in bytes of a stored blob, or None if there is no such blob."""
+        raise NotImplementedError
+
+    async def iter_range(self, key, start, end, chunk_size):
+        """The bytes start..end (exclusive) of a blob, chunk_size at a time."""
+        raise NotImplementedError
+        yield
+
+    def local_path(self, key):
+        """A filesystem path holding the blob, for zero-copy sending; None for remote stores."""
+        return None
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+
+_KEY = re.compile(r"[0-9a-f]{64}")
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under `root`, fanned out by the first two hex digits of their hash.
+
+    An upload is written to root/tmp and moved into place with an atomic
+    rename, so readers never see a partial blob and concurrent uploads of the
+    same content simply both land on the same file. Disk writes happen on a
+    worker thread, `buffer_size` bytes at a time.
+    """
+
+    def __init__(self, root, buffer_size=256 * 1024):
+        self.root = os.path.abspath(root)
+        self.buffer_size = buffer_size
+        self._tmp = os.path.join(self.root, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+
+    def _path(self, key):
+        if not _KEY.fullmatch(key or ""):
+            raise ValueError(f"Invalid blob key '{key}'")
+        return os.path.join(self.root, key[:2], key)
+
+    async def put(self, chunks, max_bytes=None):
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self._tmp, uuid.uuid4().hex)
+        f = await asyncio.to_thread(open, tmp_path, "wb")
+        try:
+            buffer = bytearray()
+            async for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise BlobTooLarge(f"Attachment is larger than {max_bytes} bytes")
+                buffer += chunk
+                if len(buffer) >= self.buffer_size:
+                    await asyncio.to_thread(self._write, f, digest, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await asyncio.to_thread(self._write, f, digest, bytes(buffer))
+            await asyncio.to_thread(f.close)
+            key = digest.hexdigest()
+            created = await asyncio.to_thread(self._commit, tmp_path, key)
+            return key, size, created
+        except BaseException:
+            f.close()
+            await asyncio.to_thread(_unlink, tmp_path)
+            raise
+
+    @staticmethod
+    def _write(f, digest, data):
+        digest.update(data)
+        f.write(data)
+
+    def _commit(self, tmp_path, key):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.unlink(tmp_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return True
+
+    async def size(self, key):
+        try:
+            return (await asyncio.to_thread(os.stat, self._path(key))).st_size
+        except (OSError, ValueError):
+            return None
+
+    async def iter_range(self, key, start, end, chunk_size):
+        f = await asyncio.to_thread(open, self._path(key), "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = end - start
+            while remaining > 0:
+                data = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        finally:
+            await asyncio.to_thread(f.close)
+
+    def local_path(self, key):
+        return self._path(key)
+
+    async def delete(self, key):
+        await asyncio.to_thread(_unlink, self._path(key))
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def create_blob_store(name, root):
+    if name == "local":
+        return LocalBlobStore(root)
+    raise ValueError(f"Unknown BLOB_STORE '{name}' (expected 'local')")
+
+
+# ---------------- RANGES ----------------
+def parse_range(header, size):
+    """The (start, end) byte span, end exclusive, asked for by a Range header.
+
+    Returns None when the whole body should be sent: no header, a unit other
+    than bytes, a malformed value, or several ranges (answering those with the
+    full body is allowed and saves multipart encoding). Raises ValueError for
+    a well-formed range that lies outside the body, which is a 416.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = (part.strip() for part in spec.partition("-"))
+    if not dash or not (first or last) or not (first.isdigit() or not first) or not (last.isdigit() or not last):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(f"Range {header} is outside a body of {size} bytes")
+        return max(0, size - length), size
+    start = int(first)
+    end = int(last) + 1 if last else size
+    if end <= start and last:
+        return None
+    if start >= size:
+        raise ValueError(f"Range {header} is outside a body of {size} bytes")
+    return start, min(end, size)
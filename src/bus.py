@@ -0,0 +1,266 @@
+# src/bus.py
+import asyncio
+import json
+import logging
+from urllib.parse import unquote, urlparse
+
+from src.events import EPOCH, RESYNC
+from src.streaming import dumps
+
+logger = logging.getLogger(__name__)
+
+
+class EventBus:
+    """Carries room and status events between the API processes of a deployment.
+
+    publish() hands an event to the other processes and never blocks; events
+    published by other processes are passed to the handler set with
+    set_handler(), on the event loop. A process never receives its own events
+    back: those were already delivered locally.
+    """
+
+    origin = EPOCH
+
+    def __init__(self):
+        self._handler = None
+
+    def set_handler(self, handler):
+        self._handler = handler
+
+    def publish(self, event):
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class LocalEventBus(EventBus):
+    """Single-process deployments: every subscriber is local, so nothing is forwarded."""
+
+    def publish(self, event):
+        pass
+
+
+# ---------------- REDIS PROTOCOL ----------------
+def _command(*args):
+    """A command in RESP, the Redis wire format."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def _read_reply(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by the server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        raise ConnectionError(f"Server error: {rest.decode()}")
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        size = int(rest)
+        if size < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(size)]
+    raise ConnectionError(f"Unexpected reply: {line!r}")
+
+
+def _resync_event():
+    return {"type": RESYNC, "room_id": None, "data": None}
+
+
+class RedisEventBus(EventBus):
+    """Event bus over the pub/sub of a Redis-protocol server (Redis, Valkey, KeyDB, ...).
+
+    Speaks RESP directly over asyncio streams, so no client library is needed.
+    One connection subscribes to `channel`; another publishes, writing all
+    queued events in one go. Up to `queue_size` events wait while the server
+    is unreachable; beyond that new events are dropped (and counted), and both
+    connections retry with backoff. Whenever events may have been lost (the
+    subscriber (re)connects, or the outbox drops one) a RESYNC event is handed
+    to the local handler, and after a drop it is also published to the other
+    processes once the publisher gets through: each throws away the buffers,
+    inbox summaries and change-log tokens built from events, and its WebSocket
+    clients are told to reload.
+
+    url: redis://[:password@]host[:port] or unix:///path/to/redis.sock
+    """
+
+    def __init__(self, url, channel="webtalk:events", queue_size=10000, max_batch=256):
+        super().__init__()
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", "unix"):
+            raise ValueError(f"Unsupported event bus URL '{url}' (expected redis:// or unix://)")
+        self.url = url
+        self._parsed = parsed
+        self.channel = channel
+        self.max_batch = max_batch
+        self._outbox = asyncio.Queue(queue_size)
+        self._tasks = []
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.resyncs = 0
+        # Set once an event is dropped, until the other processes are told to resync
+        self._lost = False
+        self.connected = {"publisher": False, "subscriber": False}
+        self._delays = {"publisher": 0.1, "subscriber": 0.1}
+
+    async def _connect(self):
+        parsed = self._parsed
+        if parsed.scheme == "unix":
+            reader, writer = await asyncio.open_unix_connection(unquote(parsed.path))
+        else:
+            reader, writer = await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+        if parsed.password:
+            args = ("AUTH", unquote(parsed.username), unquote(parsed.password)) if parsed.username else \
+                ("AUTH", unquote(parsed.password))
+            writer.write(_command(*args))
+            await _read_reply(reader)
+        return reader, writer
+
+    # ---------------- PUBLISHING ----------------
+    def publish(self, event):
+        payload = dumps({"origin": self.origin, "event": event})
+        try:
+            self._outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if not self._lost:
+                self._lost = True
+                self._resync()
+
+    async def _publisher(self):
+        batch = []
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._connect()
+                self.connected["publisher"] = True
+                self._delays["publisher"] = 0.1
+                while True:
+                    if not batch:
+                        if self._lost:
+                            # Some of our events never went out; the others must not trust what they hold
+                            self._lost = False
+                            batch.append(dumps({"origin": self.origin, "event": _resync_event()}))
+                        batch.append(await self._outbox.get())
+                        while len(batch) < self.max_batch and not self._outbox.empty():
+                            batch.append(self._outbox.get_nowait())
+                    writer.write(b"".join(_command("PUBLISH", self.channel, payload) for payload in batch))
+                    await writer.drain()
+                    for _ in batch:
+                        await _read_reply(reader)
+                    self.published += len(batch)
+                    batch = []
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                # The batch in hand is retried once reconnected; the server may
+                # have delivered part of it, so receivers can see an event twice
+                await self._backoff("publisher", e)
+            finally:
+                self.connected["publisher"] = False
+                if writer is not None:
+                    writer.close()
+
+    # ---------------- SUBSCRIBING ----------------
+    async def _subscriber(self):
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._connect()
+                writer.write(_command("SUBSCRIBE", self.channel))
+                await writer.drain()
+                await _read_reply(reader)
+                self.connected["subscriber"] = True
+                self._delays["subscriber"] = 0.1
+                # Anything published before the subscription was confirmed was missed
+                self._resync()
+                while True:
+                    reply = await _read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        self._dispatch(reply[2])
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                await self._backoff("subscriber", e)
+            finally:
+                self.connected["subscriber"] = False
+                if writer is not None:
+                    writer.close()
+
+    def _dispatch(self, payload):
+        try:
+            envelope = json.loads(payload)
+        except ValueError:
+            return
+        if envelope.get("origin") == self.origin or self._handler is None:
+            return
+        self.received += 1
+        try:
+            self._handler(envelope["event"])
+        except Exception:
+            logger.exception("Event bus handler failed")
+
+    def _resync(self):
+        self.resyncs += 1
+        if self._handler is not None:
+            try:
+                self._handler(_resync_event())
+            except Exception:
+                logger.exception("Event bus handler failed")
+
+    async def _backoff(self, role, error):
+        delay = self._delays[role]
+        self._delays[role] = min(delay * 2, 5.0)
+        self.reconnects += 1
+        logger.warning("Event bus %s disconnected (%s); retrying in %.1fs", role, error, delay)
+        await asyncio.sleep(delay)
+
+    # ---------------- LIFECYCLE ----------------
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._publisher()), asyncio.create_task(self._subscriber())]
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        return {
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "resyncs": self.resyncs,
+            "queued": self._outbox.qsize(),
+        }
+
+
+def create_event_bus(url=None, channel="webtalk:events", queue_size=10000):
+    """LocalEventBus for an empty url, else a RedisEventBus on that server."""
+    if not url or url == "local":
+        return LocalEventBus()
+    return RedisEventBus(url, channel, queue_size)
@@ -0,0 +1,134 @@
+# src/config.py
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# ---------------- SUPABASE ----------------
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# ---------------- STORAGE BACKEND ----------------
+# "supabase" talks to the remote PostgREST endpoint, "sqlite" uses an embedded
+# WAL-mode database file (single-node deployments, load tests).
+DB_BACKEND = os.getenv("DB_BACKEND", "supabase").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "webtalk.db")
+
+# Seconds before a Supabase request is abandoned
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "30"))
+
+# ---------------- CACHES ----------------
+# Read-through caches for user profiles and room headers (entries, seconds)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+ROOM_CACHE_SIZE = int(os.getenv("ROOM_CACHE_SIZE", "5000"))
+ROOM_CACHE_TTL = float(os.getenv("ROOM_CACHE_TTL", "300"))
+
+# Newest messages kept in memory per active room, and the byte budget across rooms
+MESSAGE_BUFFER_SIZE = int(os.getenv("MESSAGE_BUFFER_SIZE", "200"))
+MESSAGE_BUFFER_MAX_BYTES = int(os.getenv("MESSAGE_BUFFER_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# ---------------- REAL-TIME ----------------
+# Events a WebSocket client may fall behind by before it is disconnected
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+
+# ---------------- DELTA SYNC ----------------
+# Changes remembered per room / rooms tracked for GET /messages/{room_id}/changes
+CHANGELOG_PER_ROOM = int(os.getenv("CHANGELOG_PER_ROOM", "1000"))
+CHANGELOG_MAX_ROOMS = int(os.getenv("CHANGELOG_MAX_ROOMS", "10000"))
+# ETags of GET /users and GET /rooms roll over at least this often (seconds), so
+# writes made outside this API process are eventually seen by polling clients
+LIST_ETAG_MAX_AGE = int(os.getenv("LIST_ETAG_MAX_AGE", "30"))
+
+# ---------------- MESSAGE INGESTION ----------------
+# Rows per multi-row insert, and messages accepted by one POST /messages/batch
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "500"))
+MESSAGE_BATCH_MAX_REQUEST = int(os.getenv("MESSAGE_BATCH_MAX_REQUEST", "5000"))
+# Group single sends arriving within this many milliseconds into one insert (0 = off)
+MESSAGE_WRITE_BEHIND_MS = float(os.getenv("MESSAGE_WRITE_BEHIND_MS", "0"))
+
+# ---------------- BULK OPERATIONS ----------------
+# Ids per "id IN (...)" filter; Supabase sends them in the URL query string
+ID_FILTER_CHUNK = int(os.getenv("ID_FILTER_CHUNK", "100"))
+
+# ---------------- PRESENCE ----------------
+# Seconds without a POST /status heartbeat before a user is shown offline
+PRESENCE_TIMEOUT = float(os.getenv("PRESENCE_TIMEOUT", "60"))
+# Seconds between batched writes of status changes to user_status
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "5"))
+PRESENCE_BATCH_SIZE = int(os.getenv("PRESENCE_BATCH_SIZE", "500"))
+
+# ---------------- INBOX ----------------
+# Recent messages remembered per room for unread counts (also the count's cap)
+INBOX_RECENT_MESSAGES = int(os.getenv("INBOX_RECENT_MESSAGES", "100"))
+# Rooms whose summary is kept in memory, and characters of the last-message preview
+INBOX_MAX_ROOMS = int(os.getenv("INBOX_MAX_ROOMS", "10000"))
+INBOX_PREVIEW_CHARS = int(os.getenv("INBOX_PREVIEW_CHARS", "100"))
+
+# ---------------- RESPONSES ----------------
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+# ---------------- LISTS & STREAMING ----------------
+# Largest page GET /users and GET /rooms hand out, and rows per backend read when streaming NDJSON
+LIST_PAGE_MAX = int(os.getenv("LIST_PAGE_MAX", "1000"))
+LIST_STREAM_PAGE_SIZE = int(os.getenv("LIST_STREAM_PAGE_SIZE", "1000"))
+# Messages per backend read when exporting a room's history
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+# Longest line an import accepts; compressed imports are also inflated this much at a time
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+
+# ---------------- METRICS ----------------
+# Record request, database and cache metrics and serve them on GET /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+# ---------------- PROFILING ----------------
+# Off by default. When on, requests sent with the PROFILE_HEADER header, plus a
+# PROFILE_SAMPLE_RATE share of all requests, get a Server-Timing phase breakdown
+# and a folded-stack profile written to PROFILE_DIR
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0").lower() in ("1", "true", "yes")
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# ---------------- SEND LIMITS ----------------
+# Token buckets for POST /messages: messages per second and burst size, per
+# sender and per room (a rate of 0 turns that limit off)
+SEND_RATE_PER_SENDER = float(os.getenv("SEND_RATE_PER_SENDER", "5"))
+SEND_BURST_PER_SENDER = int(os.getenv("SEND_BURST_PER_SENDER", "20"))
+SEND_RATE_PER_ROOM = float(os.getenv("SEND_RATE_PER_ROOM", "50"))
+SEND_BURST_PER_ROOM = int(os.getenv("SEND_BURST_PER_ROOM", "200"))
+# Senders and rooms whose buckets are remembered
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Shed sends while the average insert takes longer than this (0 = off), or
+# while this many inserts are already in progress (0 = no cap)
+SEND_LATENCY_THRESHOLD_MS = float(os.getenv("SEND_LATENCY_THRESHOLD_MS", "500"))
+SEND_MAX_IN_FLIGHT = int(os.getenv("SEND_MAX_IN_FLIGHT", "1000"))
+
+# ---------------- IDEMPOTENT SENDS ----------------
+# Client-chosen message ids remembered for answering retries without a query
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "100000"))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "3600"))
+
+# ---------------- EVENT BUS ----------------
+# Where room and status events are shared between API processes: empty for a
+# single process, else redis://[:password@]host[:port] or unix:///path/to.sock
+EVENT_BUS_URL = os.getenv("EVENT_BUS_URL", "")
+EVENT_BUS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "webtalk:events")
+# Events held for the other processes while the server is unreachable
+EVENT_BUS_QUEUE_SIZE = int(os.getenv("EVENT_BUS_QUEUE_SIZE", "10000"))
+
+# ---------------- ATTACHMENTS ----------------
+# Where attachment bodies are kept: "local" stores them as files under BLOB_DIR
+BLOB_STORE = os.getenv("BLOB_STORE", "local").lower()
+BLOB_DIR = os.getenv("BLOB_DIR", "blobs")
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+# Bytes of form fields and part headers a multipart upload may carry around its file
+ATTACHMENT_FORM_OVERHEAD = int(os.getenv("ATTACHMENT_FORM_OVERHEAD", str(64 * 1024)))
+# Bytes read per chunk when a download cannot be handed to the server as a file
+ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", str(256 * 1024)))
+# Attachment rows looked up by downloads
+ATTACHMENT_CACHE_SIZE = int(os.getenv("ATTACHMENT_CACHE_SIZE", "10000"))
+ATTACHMENT_CACHE_TTL = float(os.getenv("ATTACHMENT_CACHE_TTL", "300"))
@@ -1,173 +1,1309 @@
 # src/db.py
-from supabase import create_client
-import os
-from dotenv import load_dotenv
+import asyncio
+import functools
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
-# Load environment variables
-load_dotenv()
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_KEY")
-supabase = create_client(url, key)
+from src import config, metrics, profiling
 
-# ---------------- USERS ----------------
-def create_user(user_id, username, full_name, email=None, avatar_url=None):
-    try:
-        response = supabase.table("users").insert({
+
+def _utcnow():
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+_last_sent_at = None
+_sent_at_lock = threading.Lock()
+
+
+def next_sent_at():
+    """Current UTC time, nudged forward so no two calls in this process return the same value.
+
+    Rows of one multi-row insert would otherwise share the database's now()
+    and lose their order on reads sorted by (sent_at, id).
+    """
+    global _last_sent_at
+    with _sent_at_lock:
+        now = datetime.now(timezone.utc)
+        if _last_sent_at is not None and now <= _last_sent_at:
+            now = _last_sent_at + timedelta(microseconds=1)
+        _last_sent_at = now
+        return now.isoformat(timespec="microseconds")
+
+
+def utc_timestamp(value):
+    """An ISO 8601 timestamp re-emitted in UTC in next_sent_at()'s format.
+
+    Stored timestamps are compared as text on SQLite, so they all have to
+    share one offset and precision to sort in time order. A value without an
+    offset is taken as UTC. Raises ValueError when it cannot be parsed.
+    """
+    if not isinstance(value, str):
+        raise ValueError(f"not a timestamp: {value!r}")
+    parsed = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith(("Z", "z")) else value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _message_row(message: dict):
+    return {
+        # Client-chosen and imported ids are kept. The rest get one here, so every
+        # row of a multi-row insert has the same columns (PostgREST would send
+        # NULL for an id missing from some rows)
+        "id": message.get("id") or str(uuid.uuid4()),
+        "room_id": message["room_id"],
+        "sender_id": message["sender_id"],
+        "content": message["content"],
+        "message_type": message.get("message_type") or "text",
+        "reply_to_id": message.get("reply_to_id"),
+        "sent_at": message.get("sent_at") or next_sent_at(),
+        # Only imports bring messages that were already edited
+        "edited": bool(message.get("edited"))
+    }
+
+
+# SQLite says "... constraint failed"; PostgREST passes on the Postgres
+# message and its SQLSTATE, class 23 being integrity constraint violations
+_CONSTRAINT_ERROR = re.compile(r"constraint|'23\d{3}'", re.IGNORECASE)
+
+def is_constraint_error(error):
+    """True when an error returned by a backend says the row itself was refused, so retrying will not help."""
+    return bool(error) and _CONSTRAINT_ERROR.search(str(error)) is not None
+
+
+# ---------------- FIELD PROJECTION ----------------
+# Columns a caller may ask for with fields=; anything else is rejected, so a
+# projection is always safe to put into a select
+USER_FIELDS = ("id", "username", "full_name", "email", "avatar_url", "created_at")
+ROOM_FIELDS = ("id", "name", "created_by", "is_private", "created_at")
+MESSAGE_FIELDS = ("id", "room_id", "sender_id", "content", "message_type", "reply_to_id", "sent_at", "edited")
+
+def _columns(fields, allowed):
+    """Select list for a projection: "*" for None, else the fields in order."""
+    if not fields:
+        return "*"
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return ", ".join(dict.fromkeys(fields))
+
+
+# ---------------- SEARCH HELPERS ----------------
+SNIPPET_OPEN, SNIPPET_CLOSE = "<mark>", "</mark>"
+
+def search_terms(query):
+    """Words of a search box query, lowercased; punctuation is ignored."""
+    return re.findall(r"\w+", (query or "").lower())
+
+def _snippet(content, terms, width=80):
+    # Excerpt around the first hit with every hit wrapped, for engines without a snippet function
+    lowered = content.lower()
+    hits = [lowered.find(term) for term in terms if term in lowered]
+    start = max(0, min(hits) - width // 4) if hits else 0
+    excerpt = content[start:start + width]
+    if terms:
+        pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+        excerpt = pattern.sub(lambda m: f"{SNIPPET_OPEN}{m.group(0)}{SNIPPET_CLOSE}", excerpt)
+    return ("…" if start else "") + excerpt + ("…" if start + width < len(content) else "")
+
+
+# ---------------- BACKEND INTERFACE ----------------
+class StorageBackend:
+    """Storage engine used by the managers in src/logic.py.
+
+    Every method returns {"data": ..., "error": ...} the same way the Supabase
+    client responses are unpacked, so callers never see engine-specific errors.
+    """
+
+    # USERS
+    def create_user(self, user_id, username, full_name, email=None, avatar_url=None):
+        raise NotImplementedError
+
+    def get_user_by_id(self, user_id):
+        raise NotImplementedError
+
+    def get_user_by_username(self, username):
+        raise NotImplementedError
+
+    def update_user(self, user_id, updates: dict):
+        raise NotImplementedError
+
+    def delete_user(self, user_id):
+        raise NotImplementedError
+
+    def list_users(self, fields=None, limit=None, after=None):
+        """Users; fields (a subset of USER_FIELDS) limits the columns read.
+
+        With limit and/or after, returns a page ordered by id holding the
+        `limit` users whose id comes after `after`.
+        """
+        raise NotImplementedError
+
+    def get_users_by_ids(self, user_ids: list):
+        raise NotImplementedError
+
+    # CHAT ROOMS
+    def create_chat_room(self, name, created_by, is_private=False):
+        raise NotImplementedError
+
+    def get_chat_room_by_id(self, room_id):
+        raise NotImplementedError
+
+    def list_chat_rooms(self, fields=None, limit=None, after=None):
+        """Rooms; fields and paging as in list_users."""
+        raise NotImplementedError
+
+    def delete_chat_room(self, room_id):
+        raise NotImplementedError
+
+    # ROOM MEMBERS
+    def add_user_to_room(self, user_id, room_id):
+        raise NotImplementedError
+
+    def remove_user_from_room(self, user_id, room_id):
+        raise NotImplementedError
+
+    def add_users_to_room(self, user_ids: list, room_id):
+        """Add many members with one insert. Existing members are skipped;
+        returns only the rows actually inserted."""
+        raise NotImplementedError
+
+    def remove_users_from_room(self, user_ids: list, room_id):
+        """Remove many members with one delete; returns the rows removed."""
+        raise NotImplementedError
+
+    def get_users_in_room(self, room_id, limit=None, after=None, expand=False):
+        """Members of a room ordered by user_id, `limit` at a time after the
+        user_id `after`. With expand, each row also carries the member's
+        profile under "user", fetched in the same query."""
+        raise NotImplementedError
+
+    def get_rooms_for_user(self, user_id, limit=None, after=None, expand=False):
+        """Memberships of a user ordered by room_id; with expand, each row
+        carries the room under "room"."""
+        raise NotImplementedError
+
+    def mark_room_read(self, user_id, room_id, read_at):
+        """Set a member's read marker; returns the updated membership row."""
+        raise NotImplementedError
+
+    # MESSAGES
+    def send_message(self, room_id, sender_id, content, message_type="text", reply_to_id=None, message_id=None):
+        """Insert one message. message_id is a client-chosen id; inserting an id
+        that already exists fails on the primary key."""
+        raise NotImplementedError
+
+    def send_messages(self, messages: list):
+        """Insert many messages with one statement, in list order.
+
+        Each item has the send_message fields; a missing sent_at is filled with
+        increasing timestamps. Returns the inserted rows in the same order.
+        """
+        raise NotImplementedError
+
+    def get_messages_for_room(self, room_id, limit=50, offset=0, before=None, after=None, fields=None):
+        """Newest-first page of a room's messages.
+
+        before/after are (sent_at, id) keys: only messages strictly older or
+        newer than that key are returned, so each page is an index seek rather
+        than an offset scan. offset is kept for old clients only. fields (a
+        subset of MESSAGE_FIELDS) limits the columns read.
+        """
+        raise NotImplementedError
+
+    def get_messages_by_ids(self, message_ids: list):
+        """The messages with these ids that exist, in no particular order."""
+        raise NotImplementedError
+
+    def get_latest_messages_for_rooms(self, room_ids: list, per_room):
+        """The newest `per_room` messages of each room with one query, in no particular order."""
+        raise NotImplementedError
+
+    def search_messages(self, room_ids: list, query, limit=20, offset=0):
+        """Messages of these rooms matching every word of query, best match first.
+
+        Each row carries a "snippet" of its content with the hits wrapped in
+        <mark>...</mark>.
+        """
+        raise NotImplementedError
+
+    def edit_message(self, message_id, new_content):
+        raise NotImplementedError
+
+    def delete_message(self, message_id):
+        raise NotImplementedError
+
+    # ATTACHMENTS
+    def create_attachment(self, message_id, sha256, size, content_type, filename=None):
+        """Link a stored blob to a message; returns the new attachment row."""
+        raise NotImplementedError
+
+    def get_attachment(self, attachment_id):
+        raise NotImplementedError
+
+    def get_attachments_for_message(self, message_id):
+        """Attachments of a message, oldest first."""
+        raise NotImplementedError
+
+    def is_blob_referenced(self, sha256):
+        """Whether any attachment points at a blob, i.e. it must not be deleted."""
+        raise NotImplementedError
+
+    # USER STATUS
+    def update_user_status(self, user_id, status):
+        raise NotImplementedError
+
+    def get_user_status(self, user_id):
+        raise NotImplementedError
+
+    def update_user_statuses(self, statuses: list):
+        """Upsert many {"user_id", "status", "last_seen"} rows with one statement."""
+        raise NotImplementedError
+
+    def get_user_statuses(self, user_ids: list):
+        raise NotImplementedError
+
+
+# ---------------- SUPABASE BACKEND ----------------
+def _keyset_page(query, limit, after):
+    # Unpaged reads keep the table's natural order
+    if limit is None and after is None:
+        return query
+    if after is not None:
+        query = query.gt("id", after)
+    query = query.order("id")
+    return query if limit is None else query.limit(limit)
+
+
+class SupabaseBackend(StorageBackend):
+    """Remote PostgREST storage. The client is created on first use, not at import."""
+
+    def __init__(self, url=None, key=None):
+        self.url = url or config.SUPABASE_URL
+        self.key = key or config.SUPABASE_KEY
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from supabase import create_client
+                    self._client = create_client(self.url, self.key)
+        return self._client
+
+    def _execute(self, build, transform=None):
+        try:
+            response = build(self.client).execute()
+            data = getattr(response, "data", None)
+            if transform is not None and data is not None:
+                data = transform(data)
+            return {"data": data, "error": getattr(response, "error", None)}
+        except Exception as e:
+            return {"data": None, "error": str(e)}
+
+    # USERS
+    def create_user(self, user_id, username, full_name, email=None, avatar_url=None):
+        return self._execute(lambda c: c.table("users").insert({
             "id": user_id,
             "username": username,
             "full_name": full_name,
             "email": email,
             "avatar_url": avatar_url
-        }).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+        }))
+
+    def get_user_by_id(self, user_id):
+        return self._execute(lambda c: c.table("users").select("*").eq("id", user_id).single())
+
+    def get_user_by_username(self, username):
+        return self._execute(lambda c: c.table("users").select("*").eq("username", username).single())
+
+    def update_user(self, user_id, updates: dict):
+        return self._execute(lambda c: c.table("users").update(updates).eq("id", user_id))
+
+    def delete_user(self, user_id):
+        return self._execute(lambda c: c.table("users").delete().eq("id", user_id))
+
+    def list_users(self, fields=None, limit=None, after=None):
+        columns = _columns(fields, USER_FIELDS)
+        return self._execute(lambda c: _keyset_page(c.table("users").select(columns), limit, after))
+
+    def get_users_by_ids(self, user_ids: list):
+        return self._execute(lambda c: c.table("users").select("*").in_("id", list(user_ids)))
+
+    # CHAT ROOMS
+    def create_chat_room(self, name, created_by, is_private=False):
+        return self._execute(lambda c: c.table("chat_rooms").insert({
+            "name": name,
+            "created_by": created_by,
+            "is_private": is_private
+        }))
+
+    def get_chat_room_by_id(self, room_id):
+        return self._execute(lambda c: c.table("chat_rooms").select("*").eq("id", room_id).single())
+
+    def list_chat_rooms(self, fields=None, limit=None, after=None):
+        columns = _columns(fields, ROOM_FIELDS)
+        return self._execute(lambda c: _keyset_page(c.table("chat_rooms").select(columns), limit, after))
+
+    def delete_chat_room(self, room_id):
+        return self._execute(lambda c: c.table("chat_rooms").delete().eq("id", room_id))
+
+    # ROOM MEMBERS
+    def add_user_to_room(self, user_id, room_id):
+        return self._execute(lambda c: c.table("room_members").insert({
+            "user_id": user_id,
+            "room_id": room_id
+        }))
+
+    def remove_user_from_room(self, user_id, room_id):
+        return self._execute(lambda c: c.table("room_members").delete().eq("user_id", user_id).eq("room_id", room_id))
+
+    def add_users_to_room(self, user_ids: list, room_id):
+        rows = [{"user_id": user_id, "room_id": room_id} for user_id in user_ids]
+        return self._execute(lambda c: c.table("room_members").upsert(rows, on_conflict="user_id,room_id", ignore_duplicates=True))
+
+    def remove_users_from_room(self, user_ids: list, room_id):
+        return self._execute(lambda c: c.table("room_members").delete().eq("room_id", room_id).in_("user_id", list(user_ids)))
+
+    def get_users_in_room(self, room_id, limit=None, after=None, expand=False):
+        def build(c):
+            # users(*) is embedded by PostgREST through the room_members.user_id foreign key
+            query = c.table("room_members").select("*, user:users(*)" if expand else "user_id").eq("room_id", room_id)
+            if after is not None:
+                query = query.gt("user_id", after)
+            query = query.order("user_id")
+            return query if limit is None else query.limit(limit)
+        return self._execute(build)
+
+    def get_rooms_for_user(self, user_id, limit=None, after=None, expand=False):
+        def build(c):
+            query = c.table("room_members").select("*, room:chat_rooms(*)" if expand else "room_id").eq("user_id", user_id)
+            if after is not None:
+                query = query.gt("room_id", after)
+            query = query.order("room_id")
+            return query if limit is None else query.limit(limit)
+        return self._execute(build)
+
+    def mark_room_read(self, user_id, room_id, read_at):
+        return self._execute(lambda c: c.table("room_members").update({"last_read_at": read_at}).eq("user_id", user_id).eq("room_id", room_id))
+
+    # MESSAGES
+    def send_message(self, room_id, sender_id, content, message_type="text", reply_to_id=None, message_id=None):
+        row = {
+            "room_id": room_id,
+            "sender_id": sender_id,
+            "content": content,
+            "message_type": message_type,
+            "reply_to_id": reply_to_id,
+            # Same clock as send_messages and the SQLite backend, so (sent_at, id) order holds across paths
+            "sent_at": next_sent_at()
+        }
+        if message_id:
+            row["id"] = message_id
+        return self._execute(lambda c: c.table("messages").insert(row))
+
+    def send_messages(self, messages: list):
+        rows = [_message_row(message) for message in messages]
+        return self._execute(lambda c: c.table("messages").insert(rows))
+
+    def get_messages_for_room(self, room_id, limit=50, offset=0, before=None, after=None, fields=None):
+        columns = _columns(fields, MESSAGE_FIELDS)
+
+        def build(c):
+            query = c.table("messages").select(columns).eq("room_id", room_id)
+            if before is not None:
+                sent_at, message_id = before
+                query = query.or_(f'sent_at.lt."{sent_at}",and(sent_at.eq."{sent_at}",id.lt."{message_id}")')
+            elif after is not None:
+                sent_at, message_id = after
+                query = query.or_(f'sent_at.gt."{sent_at}",and(sent_at.eq."{sent_at}",id.gt."{message_id}")')
+            # Walk forward from an "after" key, then flip the page back to newest-first
+            descending = after is None
+            query = query.order("sent_at", desc=descending).order("id", desc=descending).limit(limit)
+            if offset and before is None and after is None:
+                query = query.offset(offset)
+            return query
+        return self._execute(build, None if after is None else lambda rows: rows[::-1])
+
+    def get_messages_by_ids(self, message_ids: list):
+        return self._execute(lambda c: c.table("messages").select("*").in_("id", list(message_ids)))
+
+    def get_latest_messages_for_rooms(self, room_ids: list, per_room):
+        # Embedded resources are ordered and limited per parent row, so each room gets its own newest per_room
+        return self._execute(
+            lambda c: c.table("chat_rooms").select("id, messages(*)").in_("id", list(room_ids))
+                .order("sent_at", desc=True, foreign_table="messages")
+                .limit(per_room, foreign_table="messages"),
+            lambda rooms: [message for room in rooms for message in room.get("messages") or []]
+        )
+
+    def search_messages(self, room_ids: list, query, limit=20, offset=0):
+        # websearch_to_tsquery over content; expects a GIN index on to_tsvector('english', content).
+        # PostgREST cannot order by ts_rank, so hits come newest first.
+        terms = search_terms(query)
+        return self._execute(
+            lambda c: c.table("messages").select("*").in_("room_id", list(room_ids))
+                .filter("content", "wfts(english)", " ".join(terms))
+                .order("sent_at", desc=True).order("id", desc=True)
+                .limit(limit).offset(offset),
+            lambda rows: [{**row, "snippet": _snippet(row.get("content") or "", terms)} for row in rows]
+        )
+
+    def edit_message(self, message_id, new_content):
+        return self._execute(lambda c: c.table("messages").update({
+            "content": new_content,
+            "edited": True
+        }).eq("id", message_id))
+
+    def delete_message(self, message_id):
+        return self._execute(lambda c: c.table("messages").delete().eq("id", message_id))
+
+    # ATTACHMENTS
+    def create_attachment(self, message_id, sha256, size, content_type, filename=None):
+        return self._execute(lambda c: c.table("attachments").insert({
+            "message_id": message_id,
+            "sha256": sha256,
+            "size": size,
+            "content_type": content_type,
+            "filename": filename
+        }))
+
+    def get_attachment(self, attachment_id):
+        return self._execute(lambda c: c.table("attachments").select("*").eq("id", attachment_id).single())
+
+    def get_attachments_for_message(self, message_id):
+        return self._execute(
+            lambda c: c.table("attachments").select("*").eq("message_id", message_id).order("created_at").order("id")
+        )
+
+    def is_blob_referenced(self, sha256):
+        return self._execute(
+            lambda c: c.table("attachments").select("id").eq("sha256", sha256).limit(1),
+            lambda rows: bool(rows)
+        )
+
+    # USER STATUS
+    def update_user_status(self, user_id, status):
+        return self._execute(lambda c: c.table("user_status").upsert({
+            "user_id": user_id,
+            "status": status
+        }))
+
+    def get_user_status(self, user_id):
+        return self._execute(lambda c: c.table("user_status").select("*").eq("user_id", user_id).single())
+
+    def update_user_statuses(self, statuses: list):
+        return self._execute(lambda c: c.table("user_status").upsert(list(statuses), on_conflict="user_id"))
+
+    def get_user_statuses(self, user_ids: list):
+        return self._execute(lambda c: c.table("user_status").select("*").in_("user_id", list(user_ids)))
+
+
+# ---------------- ASYNC SUPABASE BACKEND ----------------
+class AsyncSupabaseBackend(SupabaseBackend):
+    """Awaitable twin of SupabaseBackend.
+
+    The query builders are inherited unchanged; only execution differs. Every
+    call goes through one shared AsyncClient, so requests reuse the pooled
+    keep-alive connections of its PostgREST session instead of a thread each.
+    """
+
+    def __init__(self, url=None, key=None):
+        super().__init__(url, key)
+        self._async_client_lock = asyncio.Lock()
+
+    async def get_client(self):
+        if self._client is None:
+            async with self._async_client_lock:
+                if self._client is None:
+                    from supabase import AsyncClientOptions, acreate_client
+                    options = AsyncClientOptions(postgrest_client_timeout=config.DB_TIMEOUT)
+                    self._client = await acreate_client(self.url, self.key, options=options)
+        return self._client
+
+    async def _execute(self, build, transform=None):
+        try:
+            client = await self.get_client()
+            response = await build(client).execute()
+            data = getattr(response, "data", None)
+            if transform is not None and data is not None:
+                data = transform(data)
+            return {"data": data, "error": getattr(response, "error", None)}
+        except Exception as e:
+            return {"data": None, "error": str(e)}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.postgrest.aclose()
+            self._client = None
+
+
+# ---------------- SQLITE BACKEND ----------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    full_name TEXT NOT NULL,
+    email TEXT,
+    avatar_url TEXT,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS chat_rooms (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_by TEXT REFERENCES users(id) ON DELETE SET NULL,
+    is_private INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS room_members (
+    user_id TEXT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    room_id TEXT NOT NULL REFERENCES chat_rooms(id) ON DELETE CASCADE,
+    joined_at TEXT NOT NULL,
+    last_read_at TEXT,
+    PRIMARY KEY (user_id, room_id)
+);
+CREATE INDEX IF NOT EXISTS room_members_room_user_idx ON room_members (room_id, user_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    room_id TEXT NOT NULL REFERENCES chat_rooms(id) ON DELETE CASCADE,
+    sender_id TEXT REFERENCES users(id) ON DELETE SET NULL,
+    content TEXT NOT NULL,
+    message_type TEXT NOT NULL DEFAULT 'text',
+    reply_to_id TEXT,
+    sent_at TEXT NOT NULL,
+    edited INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_room_sent_idx ON messages (room_id, sent_at, id);
+
+CREATE TABLE IF NOT EXISTS attachments (
+    id TEXT PRIMARY KEY,
+    message_id TEXT NOT NULL REFERENCES messages(id) ON DELETE CASCADE,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    content_type TEXT NOT NULL,
+    filename TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attachments_message_idx ON attachments (message_id, created_at);
+CREATE INDEX IF NOT EXISTS attachments_sha256_idx ON attachments (sha256);
+
+CREATE TABLE IF NOT EXISTS user_status (
+    user_id TEXT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    status TEXT NOT NULL,
+    last_seen TEXT NOT NULL
+);
+"""
+
+# Full-text index over messages.content, kept current by triggers in the same
+# transaction as each write. It is keyed on the implicit rowid of messages, which
+# VACUUM may renumber; run INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')
+# after a VACUUM.
+SQLITE_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+    INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+END;
+"""
+
+# Columns stored as INTEGER 0/1 that the API exposes as booleans
+_SQLITE_BOOL_COLUMNS = {"is_private", "edited"}
+
+# Columns a user update may touch
+_USER_COLUMNS = {"username", "full_name", "email", "avatar_url"}
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded storage in a single WAL-mode SQLite file.
+
+    One connection is shared by all threads and serialized with a lock; every
+    statement is a local call, so there is no network round-trip per query.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.SQLITE_PATH
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Columns added after the first release; CREATE TABLE IF NOT EXISTS leaves old files alone
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(room_members)")}
+        if "last_read_at" not in columns:
+            self._conn.execute("ALTER TABLE room_members ADD COLUMN last_read_at TEXT")
+        self.fts = self._create_search_index()
+
+    def _create_search_index(self):
+        """Set up the FTS5 index over message content; False when SQLite lacks FTS5."""
+        exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        try:
+            self._conn.executescript(SQLITE_SEARCH_SCHEMA)
+        except sqlite3.OperationalError:
+            return False
+        if not exists:
+            # Index the messages written before the index existed
+            self._conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        data = dict(row)
+        for column in _SQLITE_BOOL_COLUMNS & data.keys():
+            data[column] = bool(data[column])
+        return data
+
+    def _run(self, fn):
+        with self._lock:
+            try:
+                return {"data": fn(self._conn), "error": None}
+            except Exception as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                return {"data": None, "error": str(e)}
+
+    def _insert(self, table, values: dict):
+        def run(conn):
+            columns = ", ".join(values)
+            placeholders = ", ".join("?" for _ in values)
+            conn.execute(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", tuple(values.values()))
+            return [self._row(values)]
+        return self._run(run)
+
+    def _select_one(self, sql, params):
+        def run(conn):
+            rows = conn.execute(sql, params).fetchall()
+            if len(rows) != 1:
+                raise LookupError(f"Expected a single row, found {len(rows)}")
+            return self._row(rows[0])
+        return self._run(run)
+
+    def _select_all(self, sql, params=()):
+        return self._run(lambda conn: [self._row(r) for r in conn.execute(sql, params).fetchall()])
+
+    def _select_embedded(self, sql, params, name, split):
+        """Rows whose columns after the first `split` are nested under `name`,
+        for `SELECT parent columns, child.* ... JOIN child` queries."""
+        def run(conn):
+            rows = []
+            for r in conn.execute(sql, params).fetchall():
+                columns = list(zip(r.keys(), r))
+                row = self._row(dict(columns[:split]))
+                row[name] = self._row(dict(columns[split:]))
+                rows.append(row)
+            return rows
+        return self._run(run)
+
+    def _delete_returning(self, table, where, params):
+        def run(conn):
+            conn.execute("BEGIN")
+            rows = [self._row(r) for r in conn.execute(f"SELECT * FROM {table} WHERE {where}", params).fetchall()]
+            conn.execute(f"DELETE FROM {table} WHERE {where}", params)
+            conn.execute("COMMIT")
+            return rows
+        return self._run(run)
+
+    def _update_returning(self, table, values: dict, where, params):
+        def run(conn):
+            assignments = ", ".join(f"{column} = ?" for column in values)
+            conn.execute("BEGIN")
+            conn.execute(f"UPDATE {table} SET {assignments} WHERE {where}", tuple(values.values()) + tuple(params))
+            rows = [self._row(r) for r in conn.execute(f"SELECT * FROM {table} WHERE {where}", params).fetchall()]
+            conn.execute("COMMIT")
+            return rows
+        return self._run(run)
+
+    # USERS
+    def create_user(self, user_id, username, full_name, email=None, avatar_url=None):
+        return self._insert("users", {
+            "id": user_id,
+            "username": username,
+            "full_name": full_name,
+            "email": email,
+            "avatar_url": avatar_url,
+            "created_at": _utcnow()
+        })
+
+    def get_user_by_id(self, user_id):
+        return self._select_one("SELECT * FROM users WHERE id = ?", (user_id,))
+
+    def get_user_by_username(self, username):
+        return self._select_one("SELECT * FROM users WHERE username = ?", (username,))
+
+    def update_user(self, user_id, updates: dict):
+        unknown = set(updates) - _USER_COLUMNS
+        if unknown:
+            return {"data": None, "error": f"Unknown user columns: {', '.join(sorted(unknown))}"}
+        if not updates:
+            return self._select_all("SELECT * FROM users WHERE id = ?", (user_id,))
+        return self._update_returning("users", updates, "id = ?", (user_id,))
+
+    def delete_user(self, user_id):
+        return self._delete_returning("users", "id = ?", (user_id,))
+
+    def _list(self, table, columns, limit, after):
+        if limit is None and after is None:
+            return self._select_all(f"SELECT {columns} FROM {table}")
+        # Keyset page over the primary key; LIMIT -1 means no limit
+        return self._select_all(
+            f"SELECT {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            ("" if after is None else after, -1 if limit is None else limit)
+        )
+
+    def list_users(self, fields=None, limit=None, after=None):
+        return self._list("users", _columns(fields, USER_FIELDS), limit, after)
+
+    def get_users_by_ids(self, user_ids: list):
+        placeholders = ", ".join("?" for _ in user_ids)
+        return self._select_all(f"SELECT * FROM users WHERE id IN ({placeholders})", tuple(user_ids))
+
+    # CHAT ROOMS
+    def create_chat_room(self, name, created_by, is_private=False):
+        return self._insert("chat_rooms", {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "created_by": created_by,
+            "is_private": bool(is_private),
+            "created_at": _utcnow()
+        })
+
+    def get_chat_room_by_id(self, room_id):
+        return self._select_one("SELECT * FROM chat_rooms WHERE id = ?", (room_id,))
+
+    def list_chat_rooms(self, fields=None, limit=None, after=None):
+        return self._list("chat_rooms", _columns(fields, ROOM_FIELDS), limit, after)
+
+    def delete_chat_room(self, room_id):
+        return self._delete_returning("chat_rooms", "id = ?", (room_id,))
+
+    # ROOM MEMBERS
+    def add_user_to_room(self, user_id, room_id):
+        return self._insert("room_members", {
+            "user_id": user_id,
+            "room_id": room_id,
+            "joined_at": _utcnow()
+        })
+
+    def remove_user_from_room(self, user_id, room_id):
+        return self._delete_returning("room_members", "user_id = ? AND room_id = ?", (user_id, room_id))
+
+    def add_users_to_room(self, user_ids: list, room_id):
+        def run(conn):
+            placeholders = ", ".join("?" for _ in user_ids)
+            conn.execute("BEGIN")
+            existing = {row["user_id"] for row in conn.execute(
+                f"SELECT user_id FROM room_members WHERE room_id = ? AND user_id IN ({placeholders})",
+                (room_id, *user_ids)
+            )}
+            joined_at = _utcnow()
+            rows = [
+                {"user_id": user_id, "room_id": room_id, "joined_at": joined_at}
+                for user_id in dict.fromkeys(user_ids) if user_id not in existing
+            ]
+            conn.executemany(
+                "INSERT INTO room_members (user_id, room_id, joined_at) VALUES (:user_id, :room_id, :joined_at)",
+                rows
+            )
+            conn.execute("COMMIT")
+            return rows
+        return self._run(run)
+
+    def remove_users_from_room(self, user_ids: list, room_id):
+        placeholders = ", ".join("?" for _ in user_ids)
+        return self._delete_returning("room_members", f"room_id = ? AND user_id IN ({placeholders})", (room_id, *user_ids))
+
+    def _memberships(self, key, value, after, limit, expand, name, table):
+        # Keyset page over the (user_id, room_id) primary key or the (room_id, user_id) index
+        other = "room_id" if key == "user_id" else "user_id"
+        where, params = f"m.{key} = ?", [value]
+        if after is not None:
+            where += f" AND m.{other} > ?"
+            params.append(after)
+        where += f" ORDER BY m.{other} LIMIT ?"
+        params.append(-1 if limit is None else limit)  # LIMIT -1 means no limit
+        if not expand:
+            return self._select_all(f"SELECT m.{other} FROM room_members m WHERE {where}", tuple(params))
+        return self._select_embedded(
+            f"SELECT m.user_id, m.room_id, m.joined_at, m.last_read_at, t.* FROM room_members m "
+            f"JOIN {table} t ON t.id = m.{other} WHERE {where}",
+            tuple(params), name, 4
+        )
+
+    def get_users_in_room(self, room_id, limit=None, after=None, expand=False):
+        return self._memberships("room_id", room_id, after, limit, expand, "user", "users")
+
+    def get_rooms_for_user(self, user_id, limit=None, after=None, expand=False):
+        return self._memberships("user_id", user_id, after, limit, expand, "room", "chat_rooms")
+
+    def mark_room_read(self, user_id, room_id, read_at):
+        return self._update_returning("room_members", {"last_read_at": read_at}, "user_id = ? AND room_id = ?", (user_id, room_id))
+
+    # MESSAGES
+    def send_message(self, room_id, sender_id, content, message_type="text", reply_to_id=None, message_id=None):
+        return self._insert("messages", {
+            "id": message_id or str(uuid.uuid4()),
+            "room_id": room_id,
+            "sender_id": sender_id,
+            "content": content,
+            "message_type": message_type,
+            "reply_to_id": reply_to_id,
+            "sent_at": next_sent_at(),
+            "edited": False
+        })
+
+    def send_messages(self, messages: list):
+        rows = [_message_row(message) for message in messages]
+
+        def run(conn):
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO messages (id, room_id, sender_id, content, message_type, reply_to_id, sent_at, edited) "
+                "VALUES (:id, :room_id, :sender_id, :content, :message_type, :reply_to_id, :sent_at, :edited)",
+                rows
+            )
+            conn.execute("COMMIT")
+            return [self._row(row) for row in rows]
+        return self._run(run)
+
+    def get_messages_for_room(self, room_id, limit=50, offset=0, before=None, after=None, fields=None):
+        columns = _columns(fields, MESSAGE_FIELDS)
+        if before is not None:
+            return self._select_all(
+                f"SELECT {columns} FROM messages WHERE room_id = ? AND (sent_at, id) < (?, ?) "
+                "ORDER BY sent_at DESC, id DESC LIMIT ?",
+                (room_id, before[0], before[1], limit)
+            )
+        if after is not None:
+            result = self._select_all(
+                f"SELECT {columns} FROM messages WHERE room_id = ? AND (sent_at, id) > (?, ?) "
+                "ORDER BY sent_at ASC, id ASC LIMIT ?",
+                (room_id, after[0], after[1], limit)
+            )
+            if result["data"] is not None:
+                result["data"].reverse()
+            return result
+        return self._select_all(
+            f"SELECT {columns} FROM messages WHERE room_id = ? ORDER BY sent_at DESC, id DESC LIMIT ? OFFSET ?",
+            (room_id, limit, offset)
+        )
+
+    def get_messages_by_ids(self, message_ids: list):
+        placeholders = ", ".join("?" for _ in message_ids)
+        return self._select_all(f"SELECT * FROM messages WHERE id IN ({placeholders})", tuple(message_ids))
+
+    def get_latest_messages_for_rooms(self, room_ids: list, per_room):
+        placeholders = ", ".join("?" for _ in room_ids)
+        return self._select_all(
+            f"SELECT id, room_id, sender_id, content, message_type, reply_to_id, sent_at, edited FROM ("
+            f"SELECT *, ROW_NUMBER() OVER (PARTITION BY room_id ORDER BY sent_at DESC, id DESC) AS position "
+            f"FROM messages WHERE room_id IN ({placeholders})) WHERE position <= ?",
+            (*room_ids, per_room)
+        )
+
+    def search_messages(self, room_ids: list, query, limit=20, offset=0):
+        terms = search_terms(query)
+        placeholders = ", ".join("?" for _ in room_ids)
+        if not self.fts:
+            # No FTS5 in this SQLite build: scan with LIKE, newest first
+            likes = " AND ".join("content LIKE ?" for _ in terms) or "1"
+            result = self._select_all(
+                f"SELECT * FROM messages WHERE room_id IN ({placeholders}) AND {likes} "
+                f"ORDER BY sent_at DESC, id DESC LIMIT ? OFFSET ?",
+                (*room_ids, *(f"%{term}%" for term in terms), limit, offset)
+            )
+            for row in result["data"] or []:
+                row["snippet"] = _snippet(row["content"], terms)
+            return result
+        # Quote every word so user input is never parsed as FTS syntax; the last one
+        # is a prefix so results show up while the user is still typing
+        match = " ".join(f'"{term}"' for term in terms) + "*"
+        return self._select_all(
+            f"SELECT m.*, snippet(messages_fts, 0, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '…', 16) AS snippet "
+            f"FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+            f"WHERE messages_fts MATCH ? AND m.room_id IN ({placeholders}) "
+            f"ORDER BY bm25(messages_fts), m.sent_at DESC LIMIT ? OFFSET ?",
+            (match, *room_ids, limit, offset)
+        )
+
+    def edit_message(self, message_id, new_content):
+        return self._update_returning("messages", {"content": new_content, "edited": True}, "id = ?", (message_id,))
+
+    def delete_message(self, message_id):
+        return self._delete_returning("messages", "id = ?", (message_id,))
+
+    # ATTACHMENTS
+    def create_attachment(self, message_id, sha256, size, content_type, filename=None):
+        return self._insert("attachments", {
+            "id": str(uuid.uuid4()),
+            "message_id": message_id,
+            "sha256": sha256,
+            "size": size,
+            "content_type": content_type,
+            "filename": filename,
+            "created_at": _utcnow()
+        })
+
+    def get_attachment(self, attachment_id):
+        return self._select_one("SELECT * FROM attachments WHERE id = ?", (attachment_id,))
+
+    def get_attachments_for_message(self, message_id):
+        return self._select_all(
+            "SELECT * FROM attachments WHERE message_id = ? ORDER BY created_at, id", (message_id,)
+        )
+
+    def is_blob_referenced(self, sha256):
+        return self._run(
+            lambda conn: conn.execute("SELECT 1 FROM attachments WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone() is not None
+        )
+
+    # USER STATUS
+    def update_user_status(self, user_id, status):
+        def run(conn):
+            row = {"user_id": user_id, "status": status, "last_seen": _utcnow()}
+            conn.execute(
+                "INSERT INTO user_status (user_id, status, last_seen) VALUES (:user_id, :status, :last_seen) "
+                "ON CONFLICT (user_id) DO UPDATE SET status = excluded.status, last_seen = excluded.last_seen",
+                row
+            )
+            return [row]
+        return self._run(run)
+
+    def get_user_status(self, user_id):
+        return self._select_one("SELECT * FROM user_status WHERE user_id = ?", (user_id,))
+
+    def update_user_statuses(self, statuses: list):
+        def run(conn):
+            rows = [{"user_id": s["user_id"], "status": s["status"], "last_seen": s.get("last_seen") or _utcnow()} for s in statuses]
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO user_status (user_id, status, last_seen) VALUES (:user_id, :status, :last_seen) "
+                "ON CONFLICT (user_id) DO UPDATE SET status = excluded.status, last_seen = excluded.last_seen",
+                rows
+            )
+            conn.execute("COMMIT")
+            return rows
+        return self._run(run)
+
+    def get_user_statuses(self, user_ids: list):
+        placeholders = ", ".join("?" for _ in user_ids)
+        return self._select_all(f"SELECT * FROM user_status WHERE user_id IN ({placeholders})", tuple(user_ids))
+
+
+# ---------------- ASYNC SQLITE BACKEND ----------------
+class AsyncSQLiteBackend:
+    """Awaitable wrapper around SQLiteBackend.
+
+    SQLite serializes access to the shared connection anyway, so calls are
+    handed to a single dedicated worker thread rather than the request
+    threadpool. Exposes the StorageBackend methods as coroutines.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else SQLiteBackend()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        return self._executor
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), functools.partial(method, *args, **kwargs))
+
+        call.__name__ = name
+        return call
+
+    async def aclose(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+# ---------------- INSTRUMENTATION ----------------
+DB_CALL_SECONDS = metrics.registry.histogram(
+    "webtalk_db_call_duration_seconds",
+    "Time spent in storage backend calls, including the wait for the SQLite thread.",
+    ("table", "operation"),
+)
+DB_CALL_ERRORS = metrics.registry.counter(
+    "webtalk_db_call_errors_total",
+    "Storage backend calls that raised or returned an error.",
+    ("table", "operation"),
+)
+
+# StorageBackend method -> (table, operation) labels
+CALL_LABELS = {
+    "create_user": ("users", "insert"),
+    "get_user_by_id": ("users", "select"),
+    "get_user_by_username": ("users", "select"),
+    "update_user": ("users", "update"),
+    "delete_user": ("users", "delete"),
+    "list_users": ("users", "select"),
+    "get_users_by_ids": ("users", "select"),
+    "create_chat_room": ("chat_rooms", "insert"),
+    "get_chat_room_by_id": ("chat_rooms", "select"),
+    "list_chat_rooms": ("chat_rooms", "select"),
+    "delete_chat_room": ("chat_rooms", "delete"),
+    "add_user_to_room": ("room_members", "insert"),
+    "remove_user_from_room": ("room_members", "delete"),
+    "add_users_to_room": ("room_members", "insert"),
+    "remove_users_from_room": ("room_members", "delete"),
+    "get_users_in_room": ("room_members", "select"),
+    "get_rooms_for_user": ("room_members", "select"),
+    "mark_room_read": ("room_members", "update"),
+    "send_message": ("messages", "insert"),
+    "send_messages": ("messages", "insert"),
+    "get_messages_for_room": ("messages", "select"),
+    "get_messages_by_ids": ("messages", "select"),
+    "get_latest_messages_for_rooms": ("messages", "select"),
+    "search_messages": ("messages", "search"),
+    "edit_message": ("messages", "update"),
+    "delete_message": ("messages", "delete"),
+    "create_attachment": ("attachments", "insert"),
+    "get_attachment": ("attachments", "select"),
+    "get_attachments_for_message": ("attachments", "select"),
+    "is_blob_referenced": ("attachments", "select"),
+    "update_user_status": ("user_status", "upsert"),
+    "get_user_status": ("user_status", "select"),
+    "update_user_statuses": ("user_status", "upsert"),
+    "get_user_statuses": ("user_status", "select"),
+}
+
+
+class InstrumentedBackend:
+    """Async backend wrapper that times every StorageBackend call.
+
+    Durations go to DB_CALL_SECONDS and failures (an exception or a result
+    with "error" set) to DB_CALL_ERRORS, labelled by table and operation, and
+    to the db span of the request being profiled, if any. Wrapped methods are
+    built once per name and then found as plain attributes.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+        labels = CALL_LABELS.get(name)
+        if labels is None or not callable(method):
+            return method
+        duration = DB_CALL_SECONDS.labels(*labels)
+        errors = DB_CALL_ERRORS.labels(*labels)
+
+        async def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await method(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                duration.observe(elapsed)
+                profile = profiling.current.get()
+                if profile is not None:
+                    profile.add_db(elapsed)
+            if isinstance(result, dict) and result.get("error"):
+                errors.inc()
+            return result
+
+        call.__name__ = name
+        setattr(self, name, call)
+        return call
+
+
+# ---------------- BACKEND SELECTION ----------------
+def create_backend(name=None):
+    name = (name or config.DB_BACKEND).lower()
+    if name == "supabase":
+        return SupabaseBackend()
+    if name == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unknown DB_BACKEND '{name}' (expected 'supabase' or 'sqlite')")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Process-wide backend chosen by DB_BACKEND, created on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def create_async_backend(name=None):
+    name = (name or config.DB_BACKEND).lower()
+    if name == "supabase":
+        return AsyncSupabaseBackend()
+    if name == "sqlite":
+        # Share the connection with the sync functions below
+        return AsyncSQLiteBackend(get_backend())
+    raise ValueError(f"Unknown DB_BACKEND '{name}' (expected 'supabase' or 'sqlite')")
+
+
+_async_backend = None
+
+
+def get_async_backend():
+    """Process-wide async backend chosen by DB_BACKEND, created on first use."""
+    global _async_backend
+    if _async_backend is None:
+        backend = create_async_backend()
+        instrumented = config.METRICS_ENABLED or config.PROFILING_ENABLED
+        _async_backend = InstrumentedBackend(backend) if instrumented else backend
+    return _async_backend
+
+
+async def close_async_backend():
+    global _async_backend
+    if _async_backend is not None:
+        await _async_backend.aclose()
+        _async_backend = None
+
+
+# ---------------- USERS ----------------
+def create_user(user_id, username, full_name, email=None, avatar_url=None):
+    return get_backend().create_user(user_id, username, full_name, email, avatar_url)
 
 def get_user_by_id(user_id):
-    try:
-        response = supabase.table("users").select("*").eq("id", user_id).single().execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().get_user_by_id(user_id)
 
 def get_user_by_username(username):
-    try:
-        response = supabase.table("users").select("*").eq("username", username).single().execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().get_user_by_username(username)
 
 def update_user(user_id, updates: dict):
-    try:
-        response = supabase.table("users").update(updates).eq("id", user_id).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().update_user(user_id, updates)
 
 def delete_user(user_id):
-    try:
-        response = supabase.table("users").delete().eq("id", user_id).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().delete_user(user_id)
+
+def list_users(fields=None, limit=None, after=None):
+    return get_backend().list_users(fields, limit, after)
+
+def get_users_by_ids(user_ids: list):
+    return get_backend().get_users_by_ids(user_ids)
 
 # ---------------- CHAT ROOMS ----------------
 def create_chat_room(name, created_by, is_private=False):
-    try:
-        response = supabase.table("chat_rooms").insert({
-            "name": name,
-            "created_by": created_by,
-            "is_private": is_private
-        }).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().create_chat_room(name, created_by, is_private)
 
 def get_chat_room_by_id(room_id):
-    try:
-        response = supabase.table("chat_rooms").select("*").eq("id", room_id).single().execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
-
-def list_chat_rooms():
-    try:
-        response = supabase.table("chat_rooms").select("*").execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().get_chat_room_by_id(room_id)
+
+def list_chat_rooms(fields=None, limit=None, after=None):
+    return get_backend().list_chat_rooms(fields, limit, after)
 
 def delete_chat_room(room_id):
-    try:
-        response = supabase.table("chat_rooms").delete().eq("id", room_id).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().delete_chat_room(room_id)
 
 # ---------------- ROOM MEMBERS ----------------
 def add_user_to_room(user_id, room_id):
-    try:
-        response = supabase.table("room_members").insert({
-            "user_id": user_id,
-            "room_id": room_id
-        }).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().add_user_to_room(user_id, room_id)
 
 def remove_user_from_room(user_id, room_id):
-    try:
-        response = supabase.table("room_members").delete().eq("user_id", user_id).eq("room_id", room_id).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
-
-def get_users_in_room(room_id):
-    try:
-        response = supabase.table("room_members").select("user_id").eq("room_id", room_id).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
-
-def get_rooms_for_user(user_id):
-    try:
-        response = supabase.table("room_members").select("room_id").eq("user_id", user_id).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().remove_user_from_room(user_id, room_id)
+
+def add_users_to_room(user_ids: list, room_id):
+    return get_backend().add_users_to_room(user_ids, room_id)
+
+def remove_users_from_room(user_ids: list, room_id):
+    return get_backend().remove_users_from_room(user_ids, room_id)
+
+def get_users_in_room(room_id, limit=None, after=None, expand=False):
+    return get_backend().get_users_in_room(room_id, limit, after, expand)
+
+def get_rooms_for_user(user_id, limit=None, after=None, expand=False):
+    return get_backend().get_rooms_for_user(user_id, limit, after, expand)
+
+def mark_room_read(user_id, room_id, read_at):
+    return get_backend().mark_room_read(user_id, room_id, read_at)
 
 # ---------------- MESSAGES ----------------
-def send_message(room_id, sender_id, content, message_type="text", reply_to_id=None):
-    try:
-        response = supabase.table("messages").insert({
-            "room_id": room_id,
-            "sender_id": sender_id,
-            "content": content,
-            "message_type": message_type,
-            "reply_to_id": reply_to_id
-        }).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
-
-def get_messages_for_room(room_id, limit=50, offset=0):
-    try:
-        response = supabase.table("messages").select("*").eq("room_id", room_id).order("sent_at", desc=True).limit(limit).offset(offset).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+def send_message(room_id, sender_id, content, message_type="text", reply_to_id=None, message_id=None):
+    return get_backend().send_message(room_id, sender_id, content, message_type, reply_to_id, message_id)
+
+def send_messages(messages: list):
+    return get_backend().send_messages(messages)
+
+def get_messages_for_room(room_id, limit=50, offset=0, before=None, after=None, fields=None):
+    return get_backend().get_messages_for_room(room_id, limit, offset, before, after, fields)
+
+def get_messages_by_ids(message_ids: list):
+    return get_backend().get_messages_by_ids(message_ids)
+
+def get_latest_messages_for_rooms(room_ids: list, per_room):
+    return get_backend().get_latest_messages_for_rooms(room_ids, per_room)
+
+def search_messages(room_ids: list, query, limit=20, offset=0):
+    return get_backend().search_messages(room_ids, query, limit, offset)
 
 def edit_message(message_id, new_content):
-    try:
-        response = supabase.table("messages").update({
-            "content": new_content,
-            "edited": True
-        }).eq("id", message_id).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().edit_message(message_id, new_content)
 
 def delete_message(message_id):
-    try:
-        response = supabase.table("messages").delete().eq("id", message_id).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().delete_message(message_id)
+
+# ---------------- ATTACHMENTS ----------------
+def create_attachment(message_id, sha256, size, content_type, filename=None):
+    return get_backend().create_attachment(message_id, sha256, size, content_type, filename)
+
+def get_attachment(attachment_id):
+    return get_backend().get_attachment(attachment_id)
+
+def get_attachments_for_message(message_id):
+    return get_backend().get_attachments_for_message(message_id)
+
+def is_blob_referenced(sha256):
+    return get_backend().is_blob_referenced(sha256)
 
 # ---------------- USER STATUS ----------------
 def update_user_status(user_id, status):
-    try:
-        response = supabase.table("user_status").upsert({
-            "user_id": user_id,
-            "status": status
-        }).execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().update_user_status(user_id, status)
 
 def get_user_status(user_id):
-    try:
-        response = supabase.table("user_status").select("*").eq("user_id", user_id).single().execute()
-        return {"data": getattr(response, "data", None), "error": getattr(response, "error", None)}
-    except Exception as e:
-        return {"data": None, "error": str(e)}
+    return get_backend().get_user_status(user_id)
+
+def update_user_statuses(statuses: list):
+    return get_backend().update_user_statuses(statuses)
+
+def get_user_statuses(user_ids: list):
+    return get_backend().get_user_statuses(user_ids)
@@ -0,0 +1,216 @@
+# src/events.py
+import asyncio
+import json
+import uuid
+from collections import OrderedDict, defaultdict, deque
+
+# Identifies this process's in-memory state in tokens handed to clients, so a
+# token issued before a restart is recognised as unknown rather than trusted.
+EPOCH = uuid.uuid4().hex[:8]
+
+# Delivered to listeners when events from other processes may have been lost:
+# everything derived from them has to be thrown away and reloaded.
+RESYNC = "resync"
+
+
+class Subscription:
+    """One listener on a room with its own bounded queue of serialized events.
+
+    If the listener falls `maxsize` events behind, its queue is dropped and it
+    receives None, meaning "you missed events, resync"; other listeners on the
+    room are never held up by it.
+    """
+
+    def __init__(self, room_id, maxsize):
+        self.room_id = room_id
+        self.overflowed = False
+        self._queue = asyncio.Queue(maxsize)
+
+    def _offer(self, payload):
+        if self.overflowed:
+            return
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self._overflow()
+
+    def _overflow(self):
+        if self.overflowed:
+            return
+        self.overflowed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def get(self):
+        """Next JSON-encoded event, or None once this subscriber has overflowed."""
+        return await self._queue.get()
+
+
+class RoomBroker:
+    """Pub/sub fan-out of room events to this process's subscribers and listeners.
+
+    Events are plain dicts like {"type": "message.created", "room_id": ..., "data": {...}}.
+    Each event is encoded to JSON once and the same string is queued for every
+    subscriber of the room. publish() never blocks, so it is safe to call from
+    the request path. With an EventBus (src/bus.py), published events are also
+    sent to the other API processes, and theirs are delivered here as if they
+    had been published locally. When the bus may have lost some of those, it
+    delivers a RESYNC event: listeners drop what they derived from events and
+    every subscriber is told to resync. Used from the event loop only.
+    """
+
+    def __init__(self, queue_size=256, bus=None):
+        self.queue_size = queue_size
+        self.bus = bus
+        self._subscriptions = defaultdict(set)
+        self._listeners = []
+        self._remote_listeners = []
+        if bus is not None:
+            bus.set_handler(self.deliver_remote)
+
+    def add_listener(self, callback, remote_only=False):
+        """Call callback(event) synchronously for every event of every room.
+
+        With remote_only, only for events that came from other processes.
+        """
+        (self._remote_listeners if remote_only else self._listeners).append(callback)
+
+    def subscribe(self, room_id):
+        subscription = Subscription(room_id, self.queue_size)
+        self._subscriptions[room_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.room_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.room_id]
+
+    def subscriber_count(self, room_id=None):
+        if room_id is not None:
+            return len(self._subscriptions.get(room_id, ()))
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, event):
+        self._deliver(event)
+        if self.bus is not None:
+            self.bus.publish(event)
+
+    def deliver_remote(self, event):
+        """Deliver an event published by another process."""
+        for callback in self._remote_listeners:
+            callback(event)
+        self._deliver(event)
+
+    def _deliver(self, event):
+        for callback in self._listeners:
+            callback(event)
+        if event.get("type") == RESYNC:
+            for subscriptions in self._subscriptions.values():
+                for subscription in subscriptions:
+                    subscription._overflow()
+            return
+        subscriptions = self._subscriptions.get(event["room_id"])
+        if not subscriptions:
+            return
+        payload = json.dumps(event, default=str)
+        for subscription in list(subscriptions):
+            subscription._offer(payload)
+
+
+class _RoomChanges:
+    __slots__ = ("entries", "floor")
+
+    def __init__(self, floor):
+        self.entries = deque()  # (seq, event type, message), oldest first
+        self.floor = floor      # changes at or below this seq may be missing
+
+
+class RoomChangeLog:
+    """Recent message changes of each room, readable from a sync token.
+
+    A token is "<epoch>.<seq>": everything the client has seen up to a global
+    sequence number. Answering "what changed since" walks back only over the
+    changes newer than the token, so an idle poll costs a dict lookup. When the
+    log can no longer prove it holds every change since a token (restart, room
+    or entries trimmed) the caller is told to reset and refetch.
+    """
+
+    def __init__(self, per_room=1000, max_rooms=10000):
+        self.per_room = per_room
+        self.max_rooms = max_rooms
+        self.seq = 0
+        self._rooms = OrderedDict()
+        # Highest seq that was discarded along with an evicted room
+        self._evicted_floor = 0
+
+    def token(self, seq=None):
+        return f"{EPOCH}.{self.seq if seq is None else seq}"
+
+    def _parse_token(self, token):
+        try:
+            epoch, seq = token.split(".")
+            seq = int(seq)
+        except (AttributeError, ValueError):
+            return None
+        if epoch != EPOCH or seq < 0 or seq > self.seq:
+            return None
+        return seq
+
+    def record(self, event):
+        """RoomBroker listener: remember a message.* event; room.reset starts the room over."""
+        if event.get("type") == RESYNC:
+            # Changes may be missing from every room: no token issued so far is complete
+            self.seq += 1
+            self._rooms.clear()
+            self._evicted_floor = self.seq
+            return
+        if event.get("type") == "room.reset":
+            # Clients holding this token or an older one have to reload the room
+            self.seq += 1
+            self._rooms[event["room_id"]] = _RoomChanges(self.seq)
+            self._rooms.move_to_end(event["room_id"])
+            self._trim_rooms()
+            return
+        if not event.get("type", "").startswith("message."):
+            return
+        self.seq += 1
+        room_id = event["room_id"]
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = self._rooms[room_id] = _RoomChanges(self._evicted_floor)
+            self._trim_rooms()
+        else:
+            self._rooms.move_to_end(room_id)
+        room.entries.append((self.seq, event["type"], event["data"]))
+        while len(room.entries) > self.per_room:
+            room.floor = room.entries.popleft()[0]
+
+    def _trim_rooms(self):
+        while len(self._rooms) > self.max_rooms:
+            _, evicted = self._rooms.popitem(last=False)
+            if evicted.entries:
+                self._evicted_floor = max(self._evicted_floor, evicted.entries[-1][0])
+
+    def changes_since(self, room_id, token):
+        """{"reset": bool, "token": str, "messages": [...], "deleted": [ids]}.
+
+        messages holds the latest state of every message created or edited
+        after the token; deleted lists ids removed after it.
+        """
+        since = self._parse_token(token) if token else None
+        room = self._rooms.get(room_id)
+        floor = room.floor if room is not None else self._evicted_floor
+        if since is None or since < floor:
+            return {"reset": True, "token": self.token(), "messages": [], "deleted": []}
+        latest = {}
+        for seq, event_type, message in reversed(room.entries if room is not None else ()):
+            if seq <= since:
+                break
+            latest.setdefault(message.get("id"), (event_type, message))
+        upserted = [m for t, m in latest.values() if t != "message.deleted"]
+        upserted.sort(key=lambda m: (m.get("sent_at") or "", str(m.get("id"))), reverse=True)
+        deleted = [m.get("id") for t, m in latest.values() if t == "message.deleted"]
+        return {"reset": False, "token": self.token(), "messages": upserted, "deleted": deleted}
@@ -0,0 +1,154 @@
+# src/inbox.py
+import bisect
+from collections import OrderedDict
+
+from src.events import RESYNC
+
+
+class _RoomSummary:
+    __slots__ = ("keys", "entries", "complete")
+
+    def __init__(self, entries, complete):
+        self.entries = entries                   # oldest -> newest message previews
+        self.keys = [_key(e) for e in entries]   # (sent_at, id), sorted, for bisect
+        self.complete = complete                 # True when the room holds nothing older
+
+
+def _key(message):
+    return (message.get("sent_at") or "", str(message.get("id")))
+
+
+class RoomSummaries:
+    """Last message and recent message keys of each room, for the inbox.
+
+    Each room keeps previews of its newest `per_room` messages, sorted by
+    (sent_at, id). The last one is the inbox preview, and the unread count for
+    a read marker is a bisect plus a walk over the messages after it, so it is
+    capped at `per_room`. Rooms are loaded from one query and then kept current
+    by record(), a RoomBroker listener. Used from the event loop only.
+    """
+
+    def __init__(self, per_room=100, max_rooms=10000, preview_chars=100):
+        self.per_room = per_room
+        self.max_rooms = max_rooms
+        self.preview_chars = preview_chars
+        self._rooms = OrderedDict()
+        # room_id -> [loads in flight, written since load started]
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def _preview(self, message):
+        content = message.get("content") or ""
+        if len(content) > self.preview_chars:
+            content = content[:self.preview_chars] + "…"
+        return {
+            "id": message.get("id"),
+            "sender_id": message.get("sender_id"),
+            "content": content,
+            "message_type": message.get("message_type"),
+            "sent_at": message.get("sent_at"),
+        }
+
+    # ---------------- READS ----------------
+    def missing(self, room_ids):
+        """The room ids that have to be loaded before summarize() can answer."""
+        return [room_id for room_id in room_ids if room_id not in self._rooms]
+
+    def summarize(self, room_id, user_id, read_at):
+        """{"last_message", "unread_count", "unread_capped"} for one member, or None if not loaded.
+
+        Messages after `read_at` count as unread, except the member's own.
+        """
+        room = self._rooms.get(room_id)
+        if room is None:
+            return None
+        self._rooms.move_to_end(room_id)
+        start = 0 if read_at is None else bisect.bisect_right(room.keys, (read_at, "\uffff"))
+        unread = sum(1 for entry in room.entries[start:] if entry["sender_id"] != user_id)
+        return {
+            "last_message": room.entries[-1] if room.entries else None,
+            "unread_count": unread,
+            # Everything we hold is unread and older messages exist: the real count may be higher
+            "unread_capped": start == 0 and not room.complete,
+        }
+
+    def begin_load(self, room_ids):
+        """Call before querying the newest per_room messages of these rooms."""
+        for room_id in room_ids:
+            self._loading.setdefault(room_id, [0, False])[0] += 1
+
+    def finish_load(self, room_ids, rows):
+        """Install rows read after begin_load (any order); pass None if the query failed.
+
+        Rooms written to while the rows were being read are skipped and loaded
+        again next time, since the rows may be missing that write.
+        """
+        by_room = {room_id: [] for room_id in room_ids}
+        for row in rows or ():
+            if row.get("room_id") in by_room:
+                by_room[row["room_id"]].append(self._preview(row))
+        for room_id, entries in by_room.items():
+            loading = self._loading[room_id]
+            loading[0] -= 1
+            if loading[0] == 0:
+                del self._loading[room_id]
+            if rows is None or loading[1]:
+                continue
+            entries.sort(key=_key)
+            self._rooms[room_id] = _RoomSummary(entries[-self.per_room:], complete=len(entries) < self.per_room)
+            self._rooms.move_to_end(room_id)
+        while len(self._rooms) > self.max_rooms:
+            self._rooms.popitem(last=False)
+
+    # ---------------- WRITES ----------------
+    def record(self, event):
+        """RoomBroker listener: apply a message.* event to its room's summary."""
+        event_type = event.get("type")
+        if event_type == "room.reset":
+            self.forget_room(event["room_id"])
+            return
+        if event_type == RESYNC:
+            self.clear()
+            return
+        if event_type not in ("message.created", "message.updated", "message.deleted"):
+            return
+        room_id = event["room_id"]
+        if room_id in self._loading:
+            self._loading[room_id][1] = True
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+        message = event["data"]
+        if event_type == "message.created":
+            key = _key(message)
+            index = bisect.bisect_right(room.keys, key)
+            if index and room.keys[index - 1] == key:
+                return  # already held (an event delivered twice)
+            if index == 0 and room.keys and not room.complete:
+                return  # older than everything we hold
+            room.keys.insert(index, key)
+            room.entries.insert(index, self._preview(message))
+            if len(room.entries) > self.per_room:
+                del room.keys[0], room.entries[0]
+                room.complete = False
+            return
+        for index, entry in enumerate(room.entries):
+            if entry["id"] == message.get("id"):
+                if event_type == "message.updated":
+                    room.entries[index] = self._preview(message)
+                else:
+                    del room.keys[index], room.entries[index]
+                    if not room.entries and not room.complete:
+                        # Nothing left to show; reload the room on next read
+                        del self._rooms[room_id]
+                return
+
+    def forget_room(self, room_id):
+        self._rooms.pop(room_id, None)
+
+    def clear(self):
+        self._rooms.clear()
+        for loading in self._loading.values():
+            loading[1] = True
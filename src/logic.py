@@ -1,198 +1,1001 @@
 # src/logic.py
-from src.db import (
-    create_user as db_create_user, get_user_by_id, get_user_by_username, update_user, delete_user,
-    create_chat_room, get_chat_room_by_id, list_chat_rooms, delete_chat_room,
-    add_user_to_room, remove_user_from_room, get_users_in_room, get_rooms_for_user,
-    send_message, get_messages_for_room, edit_message, delete_message,
-    update_user_status, get_user_status
-)
+from src.db import get_async_backend, next_sent_at, search_terms, utc_timestamp
+from src.cache import TTLCache
+from src.message_buffer import RoomMessageBuffer
+from src.events import RESYNC, RoomBroker, RoomChangeLog
+from src.batching import WriteBehindQueue
+from src.presence import PresenceService
+from src.inbox import RoomSummaries
+from src.ratelimit import SendLimiter
+from src.blobs import BlobTooLarge, create_blob_store
+from src import config
+import asyncio
+import base64
+import json
+import logging
+import time
 import uuid
-import pprint
-from src.db import supabase
+import zlib
+
+logger = logging.getLogger(__name__)
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _with_id(fields):
+    # Keyset paging needs each row's id even when the caller did not ask for it
+    return list(dict.fromkeys([*fields, "id"])) if fields else None
+
+async def _iter_pages(fetch, fields, page_size):
+    """Walk a table page by page: fetch(columns, limit, after) -> {"data", "error"}.
+
+    Yields projected pages. A failed read ends the walk with a final
+    [{"error": ...}] page, since a streamed response cannot change its status.
+    """
+    after = None
+    while True:
+        try:
+            result = await fetch(_with_id(fields), page_size, after)
+        except Exception as e:
+            result = {"data": None, "error": str(e)}
+        if result.get("error"):
+            yield [{"error": str(result["error"])}]
+            return
+        rows = result.get("data") or []
+        if rows:
+            yield _project(rows, fields)
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["id"]
+
+def _project(rows, fields):
+    """Keep only `fields` of each row; rows are returned as-is when fields is empty."""
+    if not fields:
+        return rows
+    return [{field: row.get(field) for field in fields} for row in rows]
+
+# ---------------- CURSORS ----------------
+def encode_cursor(message):
+    """Opaque page cursor for a message, built from its (sent_at, id) key."""
+    raw = json.dumps([message["sent_at"], message["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor. Raises ValueError for anything it did not produce."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sent_at, message_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return sent_at, message_id
+
+# ---------------- IDEMPOTENCY ----------------
+# Fixed namespace, so an Idempotency-Key maps to the same message id in every process
+IDEMPOTENCY_NAMESPACE = uuid.UUID("8d3c5a52-4f0e-5b8c-9c61-2f7e0b6d9a41")
+
+def idempotent_message_id(sender_id, key):
+    """Message id for a sender's Idempotency-Key: the same sender and key always give the same id."""
+    return str(uuid.uuid5(IDEMPOTENCY_NAMESPACE, f"{sender_id}:{key}"))
+
+def _fingerprint(room_id, sender_id, content):
+    # What a retry must repeat for its message id to count as the same message
+    return (room_id, sender_id, zlib.crc32(content.encode("utf-8")))
 
 # ---------------- USERS ----------------
 class UserManager:
-    def __init__(self, db=None):
-        self.db = db
+    def __init__(self, db=None, cache=None):
+        self.db = db if db is not None else get_async_backend()
+        # Profiles keyed by ("id", user_id) and ("username", username)
+        self.cache = cache if cache is not None else TTLCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
+        # Bumped on every write; lets GET /users answer 304 without a query
+        self.version = 0
 
-    def create_user(self, username, full_name, email=None, avatar_url=None):
+    def _cache_user(self, user, generation):
+        if isinstance(user, dict) and user.get("id"):
+            self.cache.set(("id", user["id"]), user, generation)
+            self.cache.set(("username", user.get("username")), user, generation)
+
+    def _invalidate_user(self, user_id):
+        self.cache.pop_where(lambda key, user: user.get("id") == user_id)
+
+    async def create_user(self, username, full_name, email=None, avatar_url=None):
         if not username or not full_name:
             return {"Success": False, "Message": "Username and full name are required."}
 
         user_id = str(uuid.uuid4())
 
         try:
-            result = db_create_user(user_id, username, full_name, email, avatar_url)
-            pprint.pprint(result)
+            result = await self.db.create_user(user_id, username, full_name, email, avatar_url)
             if result.get("error"):
+                logger.warning("create_user %r failed: %s", username, result["error"])
                 return {"Success": False, "Message": f"Error: {result['error']}"}
+            self.version += 1
             return {"Success": True, "Message": "User created successfully", "user_id": user_id}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def get_user_by_id(self, user_id):
+    async def get_user_by_id(self, user_id):
         try:
-            result = get_user_by_id(user_id)
-            if result.get("error"):
-                return {"Success": False, "Message": f"Error: {result['error']}"}
-            return {"data": result.get("data"), "count": len(result.get("data") or [])}
+            user = self.cache.get(("id", user_id))
+            if user is None:
+                generation = self.cache.generation
+                result = await self.db.get_user_by_id(user_id)
+                if result.get("error"):
+                    return {"Success": False, "Message": f"Error: {result['error']}"}
+                user = result.get("data")
+                self._cache_user(user, generation)
+            return {"data": user, "count": len(user or [])}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def update_user(self, user_id, updates: dict):
+    async def get_user_by_username(self, username):
         try:
-            result = update_user(user_id, updates)
+            user = self.cache.get(("username", username))
+            if user is None:
+                generation = self.cache.generation
+                result = await self.db.get_user_by_username(username)
+                if result.get("error"):
+                    return {"Success": False, "Message": f"Error: {result['error']}"}
+                user = result.get("data")
+                self._cache_user(user, generation)
+            return {"data": user}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+    async def update_user(self, user_id, updates: dict):
+        try:
+            result = await self.db.update_user(user_id, updates)
+            self._invalidate_user(user_id)
+            self.version += 1
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
             return {"Success": True, "Message": "User updated successfully"}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def delete_user(self, user_id):
+    async def delete_user(self, user_id):
         try:
-            result = delete_user(user_id)
+            result = await self.db.delete_user(user_id)
+            self._invalidate_user(user_id)
+            self.version += 1
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
             return {"Success": True, "Message": "User deleted successfully"}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
-        
-    def list_users(self):
+
+    async def list_users(self, fields=None, limit=None, cursor=None):
+        """All users, or with limit/cursor one page ordered by id plus the next cursor."""
         try:
-            response = supabase.table("users").select("*").execute()
-            return {"Success": True, "users": response.data}
+            paged = limit is not None or cursor is not None
+            result = await self.db.list_users(_with_id(fields) if paged else fields, limit, cursor)
+            if result.get("error"):
+                return {"Success": False, "Message": str(result["error"])}
+            rows = result.get("data") or []
+            next_cursor = rows[-1]["id"] if limit and len(rows) == limit else None
+            return {"Success": True, "users": _project(rows, fields), "next_cursor": next_cursor}
         except Exception as e:
             return {"Success": False, "Message": str(e)}
 
-
-    def get_all_users_from_db():
-        response = supabase.table("users").select("*").execute()
-        return response.data
+    def iter_users(self, fields=None, page_size=None):
+        """Async iterator over every user, one page at a time."""
+        return _iter_pages(self.db.list_users, fields, page_size or config.LIST_STREAM_PAGE_SIZE)
 
 
 # ---------------- CHAT ROOMS ----------------
 class ChatRoomManager:
-    def __init__(self, db=None):
-        self.db = db
+    def __init__(self, db=None, cache=None, statuses=None):
+        self.db = db if db is not None else get_async_backend()
+        # Room headers keyed by room id
+        self.cache = cache if cache is not None else TTLCache(config.ROOM_CACHE_SIZE, config.ROOM_CACHE_TTL)
+        # UserStatusManager used for expand=presence on member lists
+        self.statuses = statuses
+        # Bumped on every write; lets GET /rooms answer 304 without a query
+        self.version = 0
 
-    def create_chat_room(self, name, created_by, is_private=False):
+    async def create_chat_room(self, name, created_by, is_private=False):
         if not name or not created_by:
             return {"Success": False, "Message": "Room name and creator are required."}
         try:
-            result = create_chat_room(name, created_by, is_private)
+            result = await self.db.create_chat_room(name, created_by, is_private)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
+            self.version += 1
             return {"Success": True, "Message": "Chat room created", "room_id": result["data"][0]["id"]}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def add_user_to_room(self, user_id, room_id):
+    async def get_chat_room_by_id(self, room_id):
+        try:
+            room = self.cache.get(room_id)
+            if room is None:
+                generation = self.cache.generation
+                result = await self.db.get_chat_room_by_id(room_id)
+                if result.get("error"):
+                    return {"Success": False, "Message": f"Error: {result['error']}"}
+                room = result.get("data")
+                if room:
+                    self.cache.set(room_id, room, generation)
+            return {"data": room}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+    async def delete_chat_room(self, room_id):
         try:
-            result = add_user_to_room(user_id, room_id)
+            result = await self.db.delete_chat_room(room_id)
+            self.cache.pop(room_id)
+            self.version += 1
+            if result.get("error"):
+                return {"Success": False, "Message": f"Error: {result['error']}"}
+            return {"Success": True, "Message": "Chat room deleted"}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+    async def add_user_to_room(self, user_id, room_id):
+        try:
+            result = await self.db.add_user_to_room(user_id, room_id)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
             return {"Success": True, "Message": "User added to room"}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def remove_user_from_room(self, user_id, room_id):
+    async def remove_user_from_room(self, user_id, room_id):
         try:
-            result = remove_user_from_room(user_id, room_id)
+            result = await self.db.remove_user_from_room(user_id, room_id)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
             return {"Success": True, "Message": "User removed from room"}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def get_users_in_room(self, room_id):
+    async def add_users_to_room(self, user_ids, room_id):
+        """Add many users at once; reports added / already_member / unknown_user per user."""
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {"Success": False, "Message": "At least one user ID is required."}
+        statuses = {}
+        try:
+            # Ids go into the query string of the user lookup, so keep each request bounded
+            for chunk in _chunks(user_ids, config.ID_FILTER_CHUNK):
+                known = await self.db.get_users_by_ids(chunk)
+                if known.get("error"):
+                    return {"Success": False, "Message": f"Error: {known['error']}"}
+                known_ids = {user["id"] for user in known.get("data") or []}
+                addable = [user_id for user_id in chunk if user_id in known_ids]
+                added = set()
+                if addable:
+                    result = await self.db.add_users_to_room(addable, room_id)
+                    if result.get("error"):
+                        return {"Success": False, "Message": f"Error: {result['error']}"}
+                    added = {row["user_id"] for row in result.get("data") or []}
+                for user_id in chunk:
+                    if user_id in added:
+                        statuses[user_id] = "added"
+                    elif user_id in known_ids:
+                        statuses[user_id] = "already_member"
+                    else:
+                        statuses[user_id] = "unknown_user"
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+        added_count = sum(1 for status in statuses.values() if status == "added")
+        return {
+            "Success": True,
+            "Message": f"{added_count} users added to room",
+            "results": [{"user_id": user_id, "status": status} for user_id, status in statuses.items()]
+        }
+
+    async def remove_users_from_room(self, user_ids, room_id):
+        """Remove many users at once; reports removed / not_member per user."""
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {"Success": False, "Message": "At least one user ID is required."}
+        statuses = {}
+        try:
+            for chunk in _chunks(user_ids, config.ID_FILTER_CHUNK):
+                result = await self.db.remove_users_from_room(chunk, room_id)
+                if result.get("error"):
+                    return {"Success": False, "Message": f"Error: {result['error']}"}
+                removed = {row["user_id"] for row in result.get("data") or []}
+                for user_id in chunk:
+                    statuses[user_id] = "removed" if user_id in removed else "not_member"
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+        removed_count = sum(1 for status in statuses.values() if status == "removed")
+        return {
+            "Success": True,
+            "Message": f"{removed_count} users removed from room",
+            "results": [{"user_id": user_id, "status": status} for user_id, status in statuses.items()]
+        }
+
+    async def get_users_in_room(self, room_id, expand=(), limit=None, cursor=None):
+        """Members of a room, a page of `limit` after `cursor` (a user id).
+
+        expand may hold "profile" (each row gets the user under "user", joined
+        in the same query) and "presence" (each row gets "status", looked up
+        for the whole page at once).
+        """
         try:
-            result = get_users_in_room(room_id)
+            result = await self.db.get_users_in_room(room_id, limit, cursor, "profile" in expand)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
-            return {"data": result.get("data")}
+            rows = result.get("data") or []
+            if "presence" in expand and rows and self.statuses is not None:
+                statuses = await self.statuses.get_user_statuses([row["user_id"] for row in rows])
+                if "data" not in statuses:
+                    return statuses
+                by_user = {status["user_id"]: status["status"] for status in statuses["data"]}
+                for row in rows:
+                    row["status"] = by_user.get(row["user_id"], "offline")
+            next_cursor = rows[-1]["user_id"] if limit and len(rows) == limit else None
+            return {"data": rows, "next_cursor": next_cursor}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def get_rooms_for_user(self, user_id):
+    async def get_rooms_for_user(self, user_id, expand=(), limit=None, cursor=None):
+        """Rooms a user belongs to, a page of `limit` after `cursor` (a room id).
+        With "room" in expand each row carries the room under "room"."""
         try:
-            result = get_rooms_for_user(user_id)
+            generation = self.cache.generation
+            result = await self.db.get_rooms_for_user(user_id, limit, cursor, "room" in expand)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
-            return {"data": result.get("data")}
+            rows = result.get("data") or []
+            for row in rows:
+                if row.get("room"):
+                    self.cache.set(row["room_id"], row["room"], generation)
+            next_cursor = rows[-1]["room_id"] if limit and len(rows) == limit else None
+            return {"data": rows, "next_cursor": next_cursor}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def list_chat_rooms(self):
+    async def list_chat_rooms(self, fields=None, limit=None, cursor=None):
+        """All rooms, or with limit/cursor one page ordered by id plus the next cursor."""
         try:
-            result = list_chat_rooms()
+            paged = limit is not None or cursor is not None
+            result = await self.db.list_chat_rooms(_with_id(fields) if paged else fields, limit, cursor)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
-            return {"data": result.get("data")}
+            rows = result.get("data") or []
+            next_cursor = rows[-1]["id"] if limit and len(rows) == limit else None
+            return {"data": _project(rows, fields), "next_cursor": next_cursor}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
+    def iter_chat_rooms(self, fields=None, page_size=None):
+        """Async iterator over every room, one page at a time."""
+        return _iter_pages(self.db.list_chat_rooms, fields, page_size or config.LIST_STREAM_PAGE_SIZE)
+
 # ---------------- MESSAGES ----------------
+# Key below every real (sent_at, id), to walk a room's history from its first message
+_HISTORY_START = ("1970-01-01T00:00:00+00:00", "00000000-0000-0000-0000-000000000000")
+
 class MessageManager:
-    def __init__(self, db=None):
-        self.db = db
+    def __init__(self, db=None, buffer=None, broker=None, changes=None, write_behind_ms=None, limiter=None,
+                 recent_ids=None):
+        self.db = db if db is not None else get_async_backend()
+        # Newest messages of active rooms, kept current from the broker
+        self.buffer = buffer if buffer is not None else RoomMessageBuffer(config.MESSAGE_BUFFER_SIZE, config.MESSAGE_BUFFER_MAX_BYTES)
+        # Real-time fan-out to room subscribers (WebSockets)
+        self.broker = broker if broker is not None else RoomBroker(config.WS_SEND_QUEUE_SIZE)
+        # Recent changes per room for delta-sync polling, fed by the broker
+        self.changes = changes if changes is not None else RoomChangeLog(config.CHANGELOG_PER_ROOM, config.CHANGELOG_MAX_ROOMS)
+        self.broker.add_listener(self.changes.record)
+        self.broker.add_listener(self._apply_event)
+        # Optional write-behind queue: single sends arriving within a few
+        # milliseconds of each other go to the database as one multi-row insert
+        write_behind_ms = config.MESSAGE_WRITE_BEHIND_MS if write_behind_ms is None else write_behind_ms
+        self.write_queue = None
+        if write_behind_ms > 0:
+            self.write_queue = WriteBehindQueue(self._insert_timed, write_behind_ms / 1000, config.MESSAGE_BATCH_SIZE)
+        # Per-sender / per-room token buckets and load shedding in front of inserts
+        self.limiter = limiter if limiter is not None else SendLimiter(
+            config.SEND_RATE_PER_SENDER, config.SEND_BURST_PER_SENDER,
+            config.SEND_RATE_PER_ROOM, config.SEND_BURST_PER_ROOM,
+            config.SEND_LATENCY_THRESHOLD_MS / 1000, config.SEND_MAX_IN_FLIGHT, config.RATE_LIMIT_MAX_KEYS
+        )
+        # Client-chosen message ids stored recently -> fingerprint, so a retried
+        # send is answered without an insert; the primary key catches the rest
+        self.recent_ids = recent_ids if recent_ids is not None else TTLCache(config.IDEMPOTENCY_CACHE_SIZE, config.IDEMPOTENCY_TTL)
+        self._sending = {}   # client message id -> future resolved when its first send finishes
+
+    async def aclose(self):
+        if self.write_queue is not None:
+            await self.write_queue.drain()
+
+    async def _insert_messages(self, messages):
+        """Insert messages with one multi-row insert; returns one {"data", "error"} per message."""
+        result = await self.db.send_messages(messages)
+        rows = result.get("data") or []
+        if not result.get("error") and len(rows) == len(messages):
+            return [{"data": [row], "error": None} for row in rows]
+        if len(messages) == 1:
+            return [result if result.get("error") else {"data": None, "error": "Insert returned no row"}]
+        # A single bad row fails the whole statement; retry one by one so the rest still land
+        results = []
+        for message in messages:
+            results.extend(await self._insert_messages([message]))
+        return results
+
+    async def _insert_timed(self, messages):
+        # Feeds the limiter's latency average with the insert alone, not the
+        # write-behind window or the request around it
+        started = time.perf_counter()
+        try:
+            return await self._insert_messages(messages)
+        finally:
+            self.limiter.record_latency(time.perf_counter() - started)
 
-    def send_message(self, room_id, sender_id, content, message_type="text", reply_to_id=None):
+    def _message_sent(self, message):
+        self._publish("message.created", message)
+
+    def _apply_event(self, event):
+        """RoomBroker listener: keep the buffer current, whichever process made the change."""
+        event_type = event.get("type")
+        if event_type == "message.created":
+            self.buffer.add(event["data"])
+        elif event_type == "message.updated":
+            self.buffer.update(event["data"])
+        elif event_type == "message.deleted":
+            self.buffer.remove(event["data"])
+        elif event_type == "room.reset":
+            self.buffer.forget_room(event["room_id"])
+        elif event_type == RESYNC:
+            self.buffer.clear()
+
+    def _publish(self, event_type, message):
+        self.broker.publish({"type": event_type, "room_id": message.get("room_id"), "data": message})
+
+    async def _get_latest_messages(self, room_id, limit):
+        rows = self.buffer.get(room_id, limit)
+        if rows is not None:
+            return {"data": rows, "error": None}
+        if limit > self.buffer.per_room:
+            return await self.db.get_messages_for_room(room_id, limit)
+        # Load a full buffer's worth so the following head reads are served from memory
+        result = None
+        self.buffer.begin_load(room_id)
+        try:
+            result = await self.db.get_messages_for_room(room_id, self.buffer.per_room)
+        finally:
+            loaded = None if result is None or result.get("error") else result.get("data")
+            self.buffer.finish_load(room_id, loaded)
+        if loaded is not None:
+            return {"data": loaded[:limit], "error": None}
+        return result
+
+    def forget_room(self, room_id):
+        """Drop what every process holds in memory about a room (deleted, or history imported)."""
+        self.broker.publish({"type": "room.reset", "room_id": room_id, "data": None})
+
+    async def get_changes(self, room_id, since=None):
+        """Messages created, edited or deleted in a room after the `since` token.
+
+        With no token, or one this process cannot serve, returns reset=True and
+        a fresh token: the client reloads the room and polls from that token.
+        """
+        return self.changes.changes_since(room_id, since)
+
+    async def send_message(self, room_id, sender_id, content, message_type="text", reply_to_id=None, message_id=None):
+        """Insert one message. Raises RateLimitExceeded when a send limit refuses it.
+
+        With a client-chosen message_id the send is idempotent: repeating it
+        returns the stored message's id with duplicate=True instead of a second
+        copy, and retries of a send still in progress wait for its outcome.
+        """
         if not room_id or not sender_id or not content:
             return {"Success": False, "Message": "Room ID, sender ID, and content are required."}
+        if message_id is None:
+            return await self._send(room_id, sender_id, content, message_type, reply_to_id)
+        fingerprint = _fingerprint(room_id, sender_id, content)
+        while message_id in self._sending:
+            await asyncio.shield(self._sending[message_id])
+        known = self.recent_ids.get(message_id)
+        if known is not None:
+            return self._duplicate(message_id, known == fingerprint)
+        done = asyncio.get_running_loop().create_future()
+        self._sending[message_id] = done
+        try:
+            result = await self._send(room_id, sender_id, content, message_type, reply_to_id, message_id)
+            if result["Success"]:
+                self.recent_ids.set(message_id, fingerprint)
+                return result
+            # The insert may have failed because the id is taken: by this very
+            # message (a retry after a lost response) or by a different one
+            existing = await self._find_sent([message_id])
+            if message_id in existing:
+                return self._duplicate(message_id, existing[message_id] == fingerprint)
+            return result
+        finally:
+            del self._sending[message_id]
+            done.set_result(None)
+
+    def _duplicate(self, message_id, same_message):
+        if not same_message:
+            return {"Success": False, "Message": "Message id is already used by a different message."}
+        return {"Success": True, "Message": "Message already sent", "message_id": message_id, "duplicate": True}
+
+    async def _find_sent(self, message_ids):
+        """Fingerprints of the messages with these ids that are already stored (and remember them)."""
         try:
-            result = send_message(room_id, sender_id, content, message_type, reply_to_id)
+            result = await self.db.get_messages_by_ids(message_ids)
+        except Exception:
+            return {}
+        found = {}
+        for row in result.get("data") or []:
+            found[row["id"]] = _fingerprint(row.get("room_id"), row.get("sender_id"), row.get("content") or "")
+            self.recent_ids.set(row["id"], found[row["id"]])
+        return found
+
+    async def _send(self, room_id, sender_id, content, message_type="text", reply_to_id=None, message_id=None):
+        self.limiter.acquire(sender_id, room_id)
+        try:
+            if self.write_queue is not None:
+                # The queue's flush records the insert latency
+                result = await self.write_queue.submit({
+                    "id": message_id,
+                    "room_id": room_id,
+                    "sender_id": sender_id,
+                    "content": content,
+                    "message_type": message_type,
+                    "reply_to_id": reply_to_id
+                })
+            else:
+                started = time.perf_counter()
+                result = await self.db.send_message(room_id, sender_id, content, message_type, reply_to_id, message_id)
+                self.limiter.record_latency(time.perf_counter() - started)
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+        finally:
+            self.limiter.finished()
+        if result.get("error"):
+            return {"Success": False, "Message": f"Error: {result['error']}"}
+        self._message_sent(result["data"][0])
+        return {"Success": True, "Message": "Message sent", "message_id": result["data"][0]["id"]}
+
+    async def send_messages(self, messages: list):
+        """Send many messages in one call. Each item has the send_message fields.
+
+        Returns one result per item, in order, under "results". Batches skip
+        the per-sender and per-room buckets but are shed like single sends
+        when the database is overloaded (RateLimitExceeded). Items may carry a
+        client-chosen "id", deduplicated as in send_message.
+        """
+        if len(messages) > config.MESSAGE_BATCH_MAX_REQUEST:
+            return {"Success": False, "Message": f"At most {config.MESSAGE_BATCH_MAX_REQUEST} messages per batch."}
+        results = [None] * len(messages)
+        valid = []
+        for index, message in enumerate(messages):
+            if not message.get("room_id") or not message.get("sender_id") or not message.get("content"):
+                results[index] = {"Success": False, "Message": "Room ID, sender ID, and content are required."}
+                continue
+            known = self.recent_ids.get(message["id"]) if message.get("id") else None
+            if known is not None:
+                fingerprint = _fingerprint(message["room_id"], message["sender_id"], message["content"])
+                results[index] = self._duplicate(message["id"], known == fingerprint)
+            else:
+                valid.append(index)
+        pending = [messages[index] for index in valid]
+        self.limiter.begin(len(pending))
+        try:
+            if self.write_queue is not None:
+                inserted = await self.write_queue.submit_many(pending)
+            else:
+                inserted = []
+                for start in range(0, len(pending), config.MESSAGE_BATCH_SIZE):
+                    inserted.extend(await self._insert_timed(pending[start:start + config.MESSAGE_BATCH_SIZE]))
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+        finally:
+            self.limiter.finished(count=len(pending))
+        retried = []
+        for index, result in zip(valid, inserted):
+            message = messages[index]
+            if result.get("error"):
+                results[index] = {"Success": False, "Message": f"Error: {result['error']}"}
+                if message.get("id"):
+                    retried.append(index)
+            else:
+                self._message_sent(result["data"][0])
+                results[index] = {"Success": True, "message_id": result["data"][0]["id"]}
+                if message.get("id"):
+                    self.recent_ids.set(message["id"], _fingerprint(message["room_id"], message["sender_id"], message["content"]))
+        if retried:
+            # Failed items whose id is already stored were sent before
+            existing = await self._find_sent([messages[index]["id"] for index in retried])
+            for index in retried:
+                message = messages[index]
+                if message["id"] in existing:
+                    fingerprint = _fingerprint(message["room_id"], message["sender_id"], message["content"])
+                    results[index] = self._duplicate(message["id"], existing[message["id"]] == fingerprint)
+        sent = sum(1 for result in results if result["Success"])
+        return {"Success": sent == len(messages), "Message": f"{sent} of {len(messages)} messages sent", "results": results}
+
+    async def get_messages_for_room(self, room_id, limit=50, offset=0, before=None, after=None, fields=None):
+        if before and after:
+            return {"Success": False, "Message": "Use either 'before' or 'after', not both."}
+        try:
+            before_key = decode_cursor(before) if before else None
+            after_key = decode_cursor(after) if after else None
+        except ValueError as e:
+            return {"Success": False, "Message": f"Error: {e}"}
+        try:
+            if before_key is None and after_key is None and not offset:
+                # The buffer holds whole rows; projected after the cursor is taken
+                result = await self._get_latest_messages(room_id, limit)
+            else:
+                # Cursors are built from (sent_at, id), so those are always read
+                columns = list(dict.fromkeys([*fields, "sent_at", "id"])) if fields else None
+                result = await self.db.get_messages_for_room(room_id, limit, offset, before_key, after_key, columns)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
-            return {"Success": True, "Message": "Message sent", "message_id": result["data"][0]["id"]}
+            rows = result.get("data") or []
+            if after:
+                # Polling forward: hand back the newest key seen, even when nothing is new
+                next_cursor = encode_cursor(rows[0]) if rows else after
+            else:
+                next_cursor = encode_cursor(rows[-1]) if len(rows) == limit else None
+            return {"data": _project(rows, fields), "next_cursor": next_cursor}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def get_messages_for_room(self, room_id, limit=50, offset=0):
+    async def iter_room_messages(self, room_id, page_size=None):
+        """Async iterator over a room's whole history, oldest first, one page at a time.
+
+        Walks forward with (sent_at, id) keys, so each page is an index seek no
+        matter how deep into the room it is. A failed read ends the walk with a
+        final [{"error": ...}] page.
+        """
+        page_size = page_size or config.EXPORT_PAGE_SIZE
+        key = _HISTORY_START
+        while True:
+            try:
+                result = await self.db.get_messages_for_room(room_id, page_size, after=key)
+            except Exception as e:
+                result = {"data": None, "error": str(e)}
+            if result.get("error"):
+                yield [{"error": str(result["error"])}]
+                return
+            rows = (result.get("data") or [])[::-1]  # pages come newest-first
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            key = (rows[-1]["sent_at"], rows[-1]["id"])
+
+    async def import_messages(self, room_id, documents):
+        """Bulk-insert messages into a room from an async iterator of (line number, dict).
+
+        Rows are inserted MESSAGE_BATCH_SIZE at a time, so memory stays bounded
+        however long the stream is. Original ids, sent_at (converted to UTC)
+        and edited flags are kept, and room_id is replaced by the target room. Imported messages are not
+        published to subscribers, and the room's buffered head is dropped.
+        """
+        imported = 0
+        batch = []
+        try:
+            async for line_number, document in documents:
+                if not isinstance(document, dict) or not document.get("sender_id") or not document.get("content"):
+                    raise ValueError(f"Line {line_number}: sender_id and content are required")
+                sent_at = document.get("sent_at")
+                if sent_at is not None:
+                    try:
+                        sent_at = utc_timestamp(sent_at)
+                    except ValueError:
+                        raise ValueError(f"Line {line_number}: sent_at {sent_at!r} is not an ISO 8601 timestamp") from None
+                batch.append({
+                    "id": document.get("id") or str(uuid.uuid4()),
+                    "room_id": room_id,
+                    "sender_id": document["sender_id"],
+                    "content": document["content"],
+                    "message_type": document.get("message_type"),
+                    "reply_to_id": document.get("reply_to_id"),
+                    "sent_at": sent_at,
+                    "edited": document.get("edited") is True,
+                })
+                if len(batch) >= config.MESSAGE_BATCH_SIZE:
+                    imported += await self._import_batch(batch)
+                    batch = []
+            if batch:
+                imported += await self._import_batch(batch)
+        except Exception as e:
+            return {"Success": False, "Message": f"Error: {e}", "imported": imported}
+        finally:
+            if imported:
+                self.forget_room(room_id)
+        return {"Success": True, "Message": f"{imported} messages imported", "imported": imported}
+
+    async def _import_batch(self, batch):
+        result = await self.db.send_messages(batch)
+        if result.get("error"):
+            raise RuntimeError(result["error"])
+        return len(batch)
+
+    async def search_messages(self, room_ids, query, limit=20, offset=0):
+        """Ranked page of messages in these rooms matching query, with snippets."""
+        if not search_terms(query):
+            return {"Success": False, "Message": "Search query is required."}
+        room_ids = list(dict.fromkeys(room_ids))
+        if not room_ids:
+            return {"data": [], "next_offset": None}
         try:
-            result = get_messages_for_room(room_id, limit, offset)
+            result = await self.db.search_messages(room_ids, query, limit, offset)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
-            return {"data": result.get("data")}
+            rows = result.get("data") or []
+            return {"data": rows, "next_offset": offset + limit if len(rows) == limit else None}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+    async def search_user_messages(self, user_id, query, limit=20, offset=0):
+        """search_messages across every room the user belongs to."""
+        try:
+            memberships = await self.db.get_rooms_for_user(user_id)
+            if memberships.get("error"):
+                return {"Success": False, "Message": f"Error: {memberships['error']}"}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
+        room_ids = [row["room_id"] for row in memberships.get("data") or []]
+        return await self.search_messages(room_ids, query, limit, offset)
 
-    def edit_message(self, message_id, new_content):
+    async def edit_message(self, message_id, new_content):
         try:
-            result = edit_message(message_id, new_content)
+            result = await self.db.edit_message(message_id, new_content)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
+            for row in result.get("data") or []:
+                self._publish("message.updated", row)
             return {"Success": True, "Message": "Message updated"}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def delete_message(self, message_id):
+    async def delete_message(self, message_id):
         try:
-            result = delete_message(message_id)
+            result = await self.db.delete_message(message_id)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
+            for row in result.get("data") or []:
+                self._publish("message.deleted", {"id": row.get("id"), "room_id": row.get("room_id")})
             return {"Success": True, "Message": "Message deleted"}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-# ---------------- USER STATUS ----------------
-class UserStatusManager:
-    def __init__(self, db=None):
-        self.db = db
+# ---------------- ATTACHMENTS ----------------
+class AttachmentManager:
+    def __init__(self, db=None, store=None, cache=None, broker=None):
+        self.db = db if db is not None else get_async_backend()
+        # Attachment bodies, stored once per distinct content
+        self.store = store if store is not None else create_blob_store(config.BLOB_STORE, config.BLOB_DIR)
+        # Attachment rows keyed by id; rows never change, so only deletes evict them
+        self.cache = cache if cache is not None else TTLCache(config.ATTACHMENT_CACHE_SIZE, config.ATTACHMENT_CACHE_TTL)
+        if broker is not None:
+            broker.add_listener(self._forget_deleted)
+
+    def _forget_deleted(self, event):
+        """RoomBroker listener: attachments go with their message (or room) in the database."""
+        if event.get("type") == "message.deleted":
+            message_id = event["data"].get("id")
+            self.cache.pop_where(lambda key, row: row.get("message_id") == message_id)
+        elif event.get("type") in ("room.reset", RESYNC):
+            self.cache.clear()
+
+    async def upload(self, message_id, chunks, content_type=None, filename=None):
+        """Stream an attachment into the blob store and link it to a message.
+
+        `chunks` is an async iterator of bytes. Raises BlobTooLarge past
+        ATTACHMENT_MAX_BYTES; nothing is kept in that case.
+        """
+        if not message_id:
+            return {"Success": False, "Message": "Message ID is required."}
+        try:
+            message = await self.db.get_messages_by_ids([message_id])
+            if message.get("error"):
+                return {"Success": False, "Message": f"Error: {message['error']}"}
+            if not message.get("data"):
+                return {"Success": False, "Message": "Message not found"}
+            key, size, created = await self.store.put(chunks, config.ATTACHMENT_MAX_BYTES)
+            result = await self.db.create_attachment(
+                message_id, key, size, content_type or "application/octet-stream", filename
+            )
+            if result.get("error") or not result.get("data"):
+                if created:
+                    await self._delete_unreferenced(key)
+                return {"Success": False, "Message": f"Error: {result.get('error') or 'Insert returned no row'}"}
+            attachment = result["data"][0]
+            self.cache.set(attachment["id"], attachment)
+            return {"Success": True, "Message": "Attachment uploaded", "data": attachment}
+        except BlobTooLarge:
+            raise
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+    async def _delete_unreferenced(self, key):
+        # A blob this upload created but could not link; another upload of the
+        # same content may have linked it in the meantime
+        referenced = await self.db.is_blob_referenced(key)
+        if not referenced.get("error") and not referenced.get("data"):
+            await self.store.delete(key)
+
+    async def get_attachment(self, attachment_id):
+        try:
+            attachment = self.cache.get(attachment_id)
+            if attachment is None:
+                generation = self.cache.generation
+                result = await self.db.get_attachment(attachment_id)
+                if result.get("error"):
+                    return {"Success": False, "Message": f"Error: {result['error']}"}
+                attachment = result.get("data")
+                if attachment:
+                    self.cache.set(attachment_id, attachment, generation)
+            return {"data": attachment}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+    async def get_attachments_for_message(self, message_id):
+        try:
+            result = await self.db.get_attachments_for_message(message_id)
+            if result.get("error"):
+                return {"Success": False, "Message": f"Error: {result['error']}"}
+            return {"data": result.get("data") or []}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+# ---------------- INBOX ----------------
+class InboxManager:
+    def __init__(self, db=None, summaries=None, broker=None):
+        self.db = db if db is not None else get_async_backend()
+        # Last message and recent keys per room, kept current from the broker
+        self.summaries = summaries if summaries is not None else RoomSummaries(
+            config.INBOX_RECENT_MESSAGES, config.INBOX_MAX_ROOMS, config.INBOX_PREVIEW_CHARS
+        )
+        if broker is not None:
+            broker.add_listener(self.summaries.record)
+
+    def forget_room(self, room_id):
+        self.summaries.forget_room(room_id)
+
+    async def _load_summaries(self, room_ids):
+        """Load the rooms the summaries do not hold yet; returns an error message or None."""
+        for _ in range(2):  # a room written to mid-load is skipped once and retried
+            missing = self.summaries.missing(room_ids)
+            if not missing:
+                return None
+            for chunk in _chunks(missing, config.ID_FILTER_CHUNK):
+                result = None
+                self.summaries.begin_load(chunk)
+                try:
+                    result = await self.db.get_latest_messages_for_rooms(chunk, self.summaries.per_room)
+                finally:
+                    self.summaries.finish_load(chunk, None if result is None or result.get("error") else result.get("data") or [])
+                if result.get("error"):
+                    return result["error"]
+        return None
+
+    async def get_inbox(self, user_id):
+        """Every room of a user with its last message and unread count, newest activity first."""
+        try:
+            result = await self.db.get_rooms_for_user(user_id, expand=True)
+            if result.get("error"):
+                return {"Success": False, "Message": f"Error: {result['error']}"}
+            memberships = result.get("data") or []
+            error = await self._load_summaries(list(dict.fromkeys(m["room_id"] for m in memberships)))
+            if error:
+                return {"Success": False, "Message": f"Error: {error}"}
+            inbox = []
+            for membership in memberships:
+                room = membership.get("room") or {}
+                # Messages from before the member joined are never unread
+                read_at = membership.get("last_read_at") or membership.get("joined_at")
+                summary = self.summaries.summarize(membership["room_id"], user_id, read_at) or {
+                    "last_message": None, "unread_count": 0, "unread_capped": False
+                }
+                inbox.append({
+                    "room_id": membership["room_id"],
+                    "name": room.get("name"),
+                    "is_private": room.get("is_private"),
+                    "last_read_at": membership.get("last_read_at"),
+                    **summary,
+                })
+            inbox.sort(key=lambda item: (item["last_message"] or {}).get("sent_at") or "", reverse=True)
+            return {"data": inbox}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def update_user_status(self, user_id, status):
+    async def mark_room_read(self, user_id, room_id):
+        """Move a member's read marker to the room's newest message."""
+        if not user_id:
+            return {"Success": False, "Message": "User ID is required."}
         try:
-            result = update_user_status(user_id, status)
+            error = await self._load_summaries([room_id])
+            if error:
+                return {"Success": False, "Message": f"Error: {error}"}
+            summary = self.summaries.summarize(room_id, user_id, None)
+            last_message = summary["last_message"] if summary else None
+            read_at = last_message["sent_at"] if last_message else next_sent_at()
+            result = await self.db.mark_room_read(user_id, room_id, read_at)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
+            if not result.get("data"):
+                return {"Success": False, "Message": "User is not a member of this room"}
+            return {"Success": True, "Message": "Room marked as read", "last_read_at": read_at}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+# ---------------- USER STATUS ----------------
+class UserStatusManager:
+    def __init__(self, db=None, presence=None, broker=None, users=None):
+        self.db = db if db is not None else get_async_backend()
+        self.broker = broker
+        # Cached profiles, so a heartbeat for an unknown user is refused up front
+        self.users = users if users is not None else UserManager(self.db)
+        # Live status in memory; changes reach user_status in periodic batches
+        self.presence = presence if presence is not None else PresenceService(
+            self.db, config.PRESENCE_TIMEOUT, config.PRESENCE_FLUSH_INTERVAL, config.PRESENCE_BATCH_SIZE,
+            publish=self._publish if broker is not None else None
+        )
+        if broker is not None:
+            # Statuses heartbeated to other processes are answered from memory here too
+            broker.add_listener(self._observe, remote_only=True)
+
+    def _publish(self, row):
+        self.broker.publish({"type": "status.changed", "room_id": None, "data": row})
+
+    def _observe(self, event):
+        if event.get("type") == "status.changed":
+            self.presence.observe(event["data"])
+
+    def start(self):
+        self.presence.start()
+
+    async def aclose(self):
+        await self.presence.aclose()
+
+    async def update_user_status(self, user_id, status):
+        if not user_id or not status:
+            return {"Success": False, "Message": "User ID and status are required."}
+        try:
+            if self.presence.get(user_id) is None:
+                # Not live here yet: the row is only written at the next flush,
+                # so check the user now rather than fail silently then
+                user = await self.users.get_user_by_id(user_id)
+                if not user.get("data"):
+                    return {"Success": False, "Message": "User not found"}
+            self.presence.heartbeat(user_id, status)
             return {"Success": True, "Message": "User status updated"}
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
 
-    def get_user_status(self, user_id):
+    async def get_user_status(self, user_id):
         try:
-            result = get_user_status(user_id)
+            live = self.presence.get(user_id)
+            if live is not None:
+                return {"data": live}
+            result = await self.db.get_user_status(user_id)
             if result.get("error"):
                 return {"Success": False, "Message": f"Error: {result['error']}"}
-            return {"data": result.get("data")}
+            return {"data": self.presence.resolve_stored(result.get("data"))}
+        except Exception as e:
+            return {"Success": False, "Message": f"Unexpected error: {e}"}
+
+    async def get_user_statuses(self, user_ids):
+        """Statuses of many users: live ones from memory, the rest in one query per chunk."""
+        user_ids = list(dict.fromkeys(user_ids))
+        statuses = {}
+        missing = []
+        for user_id in user_ids:
+            live = self.presence.get(user_id)
+            if live is not None:
+                statuses[user_id] = live
+            else:
+                missing.append(user_id)
+        try:
+            for chunk in _chunks(missing, config.ID_FILTER_CHUNK):
+                result = await self.db.get_user_statuses(chunk)
+                if result.get("error"):
+                    return {"Success": False, "Message": f"Error: {result['error']}"}
+                for row in result.get("data") or []:
+                    statuses[row["user_id"]] = self.presence.resolve_stored(row)
         except Exception as e:
             return {"Success": False, "Message": f"Unexpected error: {e}"}
+        return {"data": [statuses[user_id] for user_id in user_ids if user_id in statuses]}
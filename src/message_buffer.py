@@ -0,0 +1,160 @@
+# src/message_buffer.py
+from collections import OrderedDict, deque
+
+
+def _message_key(message):
+    return (message.get("sent_at") or "", str(message.get("id")))
+
+
+def _message_size(message):
+    # Rough footprint: dict overhead plus the length of every value
+    return 200 + sum(len(str(value)) for value in message.values())
+
+
+class _RoomBuffer:
+    __slots__ = ("messages", "complete", "size")
+
+    def __init__(self, messages, complete):
+        self.messages = deque(messages)  # oldest -> newest
+        self.complete = complete         # True when the room holds nothing older
+        self.size = sum(_message_size(m) for m in messages)
+
+
+class RoomMessageBuffer:
+    """Ring buffer of the newest messages of each recently read room.
+
+    A room is loaded from one database query and from then on kept current by
+    add/update/remove, so head-of-history reads never touch the database. Rooms
+    are kept in LRU order and the least recently read are dropped whenever the
+    total estimated size exceeds max_bytes. Used from the event loop only.
+    """
+
+    def __init__(self, per_room=200, max_bytes=64 * 1024 * 1024):
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._rooms = OrderedDict()
+        # room_id -> [loads in flight, written since load started]
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._rooms)
+
+    # ---------------- READS ----------------
+    def get(self, room_id, limit):
+        """Newest-first page of `limit` messages, or None when it has to come from the database."""
+        room = self._rooms.get(room_id)
+        if room is None or (limit > len(room.messages) and not room.complete):
+            self.misses += 1
+            return None
+        self._rooms.move_to_end(room_id)
+        self.hits += 1
+        count = min(limit, len(room.messages))
+        return [room.messages[-i] for i in range(1, count + 1)]
+
+    def begin_load(self, room_id):
+        """Call before querying the newest per_room messages of a room."""
+        self._loading.setdefault(room_id, [0, False])[0] += 1
+
+    def finish_load(self, room_id, rows):
+        """Install rows (newest-first) read after begin_load; pass None if the query failed.
+
+        The rows are discarded if the room was written to while they were being
+        read, since they may be missing that write.
+        """
+        loading = self._loading[room_id]
+        loading[0] -= 1
+        if loading[0] == 0:
+            del self._loading[room_id]
+        if rows is None or loading[1]:
+            return
+        self.forget_room(room_id)
+        room = _RoomBuffer(rows[:self.per_room][::-1], complete=len(rows) < self.per_room)
+        self._rooms[room_id] = room
+        self.size += room.size
+        self._enforce_budget()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "rooms": len(self._rooms),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    # ---------------- WRITES ----------------
+    def add(self, message):
+        room = self._touch(message.get("room_id"))
+        if room is None:
+            return
+        key = _message_key(message)
+        if not room.messages or key > _message_key(room.messages[-1]):
+            room.messages.append(message)
+        else:
+            index = len(room.messages)
+            while index > 0 and _message_key(room.messages[index - 1]) > key:
+                index -= 1
+            if index and _message_key(room.messages[index - 1]) == key:
+                return  # already held (an event delivered twice)
+            if index == 0 and not room.complete:
+                return  # older than everything we hold
+            room.messages.insert(index, message)
+        room.size += _message_size(message)
+        self.size += _message_size(message)
+        while len(room.messages) > self.per_room:
+            dropped = room.messages.popleft()
+            room.size -= _message_size(dropped)
+            self.size -= _message_size(dropped)
+            room.complete = False
+        self._enforce_budget()
+
+    def update(self, message):
+        room = self._touch(message.get("room_id"))
+        if room is None:
+            return
+        for index, current in enumerate(room.messages):
+            if current.get("id") == message.get("id"):
+                delta = _message_size(message) - _message_size(current)
+                room.messages[index] = message
+                room.size += delta
+                self.size += delta
+                return
+
+    def remove(self, message):
+        room = self._touch(message.get("room_id"))
+        if room is None:
+            return
+        for current in room.messages:
+            if current.get("id") == message.get("id"):
+                room.messages.remove(current)
+                room.size -= _message_size(current)
+                self.size -= _message_size(current)
+                return
+
+    def forget_room(self, room_id):
+        room = self._rooms.pop(room_id, None)
+        if room is not None:
+            self.size -= room.size
+
+    def clear(self):
+        self._rooms.clear()
+        self.size = 0
+        # Loads in flight may be missing whatever made us clear
+        for loading in self._loading.values():
+            loading[1] = True
+
+    # ---------------- INTERNALS ----------------
+    def _touch(self, room_id):
+        if room_id in self._loading:
+            self._loading[room_id][1] = True
+        return self._rooms.get(room_id)
+
+    def _enforce_budget(self):
+        while self.size > self.max_bytes and self._rooms:
+            _, room = self._rooms.popitem(last=False)
+            self.size -= room.size
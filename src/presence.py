@@ -0,0 +1,176 @@
+# src/presence.py
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from src.db import is_constraint_error
+
+OFFLINE = "offline"
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+class PresenceService:
+    """Live user status held in memory, persisted in coalesced batches.
+
+    Every POST /status is a heartbeat. Repeating the current status only
+    refreshes the in-memory timestamp; a status change is queued and written
+    with the other queued changes on the next flush. Users with no heartbeat
+    for `timeout` seconds go offline. An unchanged status is re-persisted once
+    per timeout/2 so other processes reading the table can tell it is fresh.
+
+    Every queued row is also passed to `publish`, if given, so other processes
+    can observe() it and answer for the user from memory too.
+    """
+
+    def __init__(self, db, timeout=60.0, flush_interval=5.0, batch_size=500, publish=None):
+        self.db = db
+        self.publish = publish
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.last_error = None
+        self._live = {}          # user_id -> {"user_id", "status", "last_seen"}
+        self._heartbeats = {}    # user_id -> monotonic time of last heartbeat
+        self._persisted_at = {}  # user_id -> monotonic time its row was last queued
+        self._dirty = {}         # user_id -> row waiting for the next flush
+        self._remote = set()     # users whose heartbeats go to another process
+        self._task = None
+
+    # ---------------- WRITES ----------------
+    def heartbeat(self, user_id, status):
+        """Record a heartbeat; returns True when the status actually changed."""
+        now = time.monotonic()
+        current = self._live.get(user_id)
+        row = {"user_id": user_id, "status": status, "last_seen": _utcnow()}
+        self._live[user_id] = row
+        self._heartbeats[user_id] = now
+        self._remote.discard(user_id)
+        changed = current is None or current["status"] != status
+        if changed or now - self._persisted_at.get(user_id, 0) >= self.timeout / 2:
+            self._queue(row)
+            self._persisted_at[user_id] = now
+        return changed
+
+    def observe(self, row):
+        """Take a row published by another process; that process persists it."""
+        user_id = row["user_id"]
+        self._live[user_id] = row
+        self._heartbeats[user_id] = time.monotonic()
+        self._remote.add(user_id)
+        self._dirty.pop(user_id, None)
+
+    def _queue(self, row):
+        self._dirty[row["user_id"]] = row
+        if self.publish is not None:
+            self.publish(row)
+
+    def sweep(self):
+        """Take users without a recent heartbeat offline; returns their ids."""
+        deadline = time.monotonic() - self.timeout
+        expired = [user_id for user_id, seen in self._heartbeats.items() if seen < deadline]
+        for user_id in expired:
+            row = self._live.pop(user_id)
+            del self._heartbeats[user_id]
+            self._persisted_at.pop(user_id, None)
+            if user_id in self._remote:
+                self._remote.discard(user_id)   # its own process takes it offline
+            elif row["status"] != OFFLINE:
+                self._queue({"user_id": user_id, "status": OFFLINE, "last_seen": row["last_seen"]})
+        return expired
+
+    async def flush(self):
+        """Write all queued status changes, batch_size rows per upsert.
+
+        Rows that could not be written are queued again for the next flush.
+        Only a row the database refuses on its own (a constraint error, e.g.
+        the user was deleted) is dropped, and its user is no longer tracked.
+        """
+        if not self._dirty:
+            return
+        rows, self._dirty = list(self._dirty.values()), {}
+        for start in range(0, len(rows), self.batch_size):
+            chunk = rows[start:start + self.batch_size]
+            result = await self.db.update_user_statuses(chunk)
+            if not result.get("error"):
+                continue
+            self.last_error = result["error"]
+            if not is_constraint_error(result["error"]):
+                # Timeout, lost connection...: keep this and the remaining rows for the next flush
+                self._requeue(rows[start:])
+                return
+            if len(chunk) == 1:
+                self._forget(chunk[0]["user_id"])
+                continue
+            # One bad row fails the whole upsert; retry one by one so the rest land
+            for row in chunk:
+                single = await self.db.update_user_statuses([row])
+                if not single.get("error"):
+                    continue
+                self.last_error = single["error"]
+                if is_constraint_error(single["error"]):
+                    self._forget(row["user_id"])
+                else:
+                    self._requeue([row])
+
+    def _requeue(self, rows):
+        for row in rows:
+            # A row queued since the flush started is newer; a remote user is persisted elsewhere
+            if row["user_id"] not in self._remote:
+                self._dirty.setdefault(row["user_id"], row)
+
+    def _forget(self, user_id):
+        # Stop tracking the user so its row is not retried on every flush
+        self._live.pop(user_id, None)
+        self._heartbeats.pop(user_id, None)
+        self._persisted_at.pop(user_id, None)
+        self._dirty.pop(user_id, None)
+        self._remote.discard(user_id)
+
+    # ---------------- READS ----------------
+    def get(self, user_id):
+        """Live status row, or None when this process has not seen the user recently."""
+        seen = self._heartbeats.get(user_id)
+        if seen is None:
+            return None
+        row = self._live[user_id]
+        if seen < time.monotonic() - self.timeout:
+            return {**row, "status": OFFLINE}
+        return row
+
+    def resolve_stored(self, row):
+        """Apply the heartbeat timeout to a row read back from the database."""
+        if not row or row.get("status") == OFFLINE or not row.get("last_seen"):
+            return row
+        try:
+            last_seen = datetime.fromisoformat(row["last_seen"])
+        except (TypeError, ValueError):
+            return row
+        if last_seen.tzinfo is None:
+            last_seen = last_seen.replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - last_seen > timedelta(seconds=self.timeout):
+            return {**row, "status": OFFLINE}
+        return row
+
+    # ---------------- BACKGROUND FLUSH ----------------
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.sweep()
+                await self.flush()
+            except Exception as e:
+                self.last_error = str(e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -0,0 +1,155 @@
+# src/profiling.py
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Profile of the request being handled, if it is being profiled
+current = contextvars.ContextVar("webtalk_profile", default=None)
+
+WAITING = "[waiting]"
+
+
+# ---------------- SPANS ----------------
+class RequestProfile:
+    """Phase timings of one request, reported as a Server-Timing header.
+
+    validation:    request start -> endpoint called (routing, body parsing, pydantic)
+    logic:         time inside the endpoint, minus database calls
+    db:            time in storage backend calls (summed)
+    serialization: endpoint returned -> response headers sent
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.endpoint_started = None
+        self.endpoint_finished = None
+        self.response_started = None
+        self.db_seconds = 0.0
+        self.db_calls = 0
+
+    def add_db(self, seconds):
+        self.db_seconds += seconds
+        self.db_calls += 1
+
+    def spans(self):
+        """[(name, milliseconds, description)] for the phases this request went through."""
+        end = self.response_started or time.perf_counter()
+        if self.endpoint_started is None:
+            # Rejected before the endpoint ran, e.g. a 422 from validation
+            return [("validation", (end - self.started) * 1000, "")]
+        endpoint_finished = self.endpoint_finished or end
+        endpoint = endpoint_finished - self.endpoint_started
+        return [
+            ("validation", (self.endpoint_started - self.started) * 1000, ""),
+            ("logic", max(0.0, endpoint - self.db_seconds) * 1000, ""),
+            ("db", self.db_seconds * 1000, f"{self.db_calls} call{'' if self.db_calls == 1 else 's'}"),
+            ("serialization", (end - endpoint_finished) * 1000, ""),
+            ("total", (end - self.started) * 1000, ""),
+        ]
+
+    def server_timing(self):
+        return ", ".join(
+            f'{name};dur={ms:.3f}' + (f';desc="{desc}"' if desc else "") for name, ms, desc in self.spans()
+        )
+
+
+def timed_endpoint(endpoint):
+    """Wrap an async endpoint so a profiled request knows when its endpoint ran."""
+    @functools.wraps(endpoint)
+    async def call(*args, **kwargs):
+        profile = current.get()
+        if profile is None:
+            return await endpoint(*args, **kwargs)
+        profile.endpoint_started = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            profile.endpoint_finished = time.perf_counter()
+    return call
+
+
+# ---------------- STACK SAMPLING ----------------
+def _label(code):
+    name = getattr(code, "co_qualname", code.co_name)
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples one asyncio task's call stack from a helper thread.
+
+    While the task runs, its frames are read from the event loop thread; while
+    it is suspended, its await chain is walked instead and the stack ends in
+    "[waiting]" (a database round trip, a lock, ...). Each sample adds one to
+    its stack, so the counts are wall-clock time in `interval` units. Must be
+    created on the event loop thread.
+    """
+
+    def __init__(self, task, interval=0.001):
+        self.task = task
+        self.loop = task.get_loop()
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._root = getattr(task.get_coro(), "cr_frame", None)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and wait for the helper thread; blocks, so call it off the event loop."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                stack = self._sample()
+            except Exception:
+                continue  # the task moved on while we looked; skip this tick
+            if stack:
+                self.samples[stack] += 1
+
+    def _sample(self):
+        if asyncio.current_task(self.loop) is self.task:
+            frame = sys._current_frames().get(self._thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                if frame is self._root:
+                    break
+                frame = frame.f_back
+            return tuple(_label(f.f_code) for f in reversed(frames))
+        labels = []
+        awaitable = self.task.get_coro()
+        while awaitable is not None:
+            frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+            if frame is None:
+                break
+            labels.append(_label(frame.f_code))
+            awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        return tuple(labels) + (WAITING,) if labels else None
+
+    def folded(self):
+        """Samples in the folded-stack format read by flamegraph.pl, speedscope and inferno."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+
+def write_profile(directory, name, content):
+    """Store a folded-stack profile; returns its path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
@@ -0,0 +1,144 @@
+# src/ratelimit.py
+import math
+import random
+import time
+from collections import OrderedDict
+
+
+class RateLimitExceeded(Exception):
+    """A send was refused; the client may retry after `retry_after` seconds.
+
+    `scope` says which limit refused it: "sender", "room" or "overload".
+    """
+
+    def __init__(self, scope, retry_after, message):
+        super().__init__(message)
+        self.scope = scope
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        # Retry-After takes whole seconds
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+# ---------------- TOKEN BUCKETS ----------------
+class TokenBuckets:
+    """One token bucket per key: `rate` tokens per second, holding at most `burst`.
+
+    Buckets are created full on first use and the least recently used are
+    dropped beyond `max_keys`; a dropped bucket would have refilled by the
+    time it is needed again unless keys churn faster than that. A rate of 0
+    disables the limit. Used from the event loop only.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> [tokens, monotonic time of last refill]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def wait_time(self, key, cost=1, now=None):
+        """Seconds until `cost` tokens are available for key (0 if they are now). Takes nothing."""
+        if not self.rate:
+            return 0.0
+        tokens = self._refill(key, time.monotonic() if now is None else now)[0]
+        return 0.0 if tokens >= cost else (cost - tokens) / self.rate
+
+    def take(self, key, cost=1, now=None):
+        if not self.rate:
+            return
+        bucket = self._refill(key, time.monotonic() if now is None else now)
+        bucket[0] -= cost
+
+    def _refill(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+
+# ---------------- SEND LIMITER ----------------
+class SendLimiter:
+    """Admission control in front of message inserts.
+
+    Each send takes one token from its sender's bucket and one from its room's
+    bucket; if either is empty the send is refused and neither is charged.
+    On top of that, sends are shed when the database is the bottleneck:
+    when more than `max_in_flight` inserts are already waiting, or when the
+    moving average of insert latency is above `latency_threshold`. In the
+    latter case a threshold/average share of sends is still let through, so
+    the average keeps being measured and recovers once the database does.
+    The average also halves every `half_life` seconds without a new
+    measurement, so an idle period after a slow burst does not keep shedding.
+    """
+
+    def __init__(self, sender_rate=0, sender_burst=1, room_rate=0, room_burst=1,
+                 latency_threshold=0, max_in_flight=0, max_keys=100000, smoothing=0.2, half_life=2.0):
+        self.senders = TokenBuckets(sender_rate, sender_burst, max_keys)
+        self.rooms = TokenBuckets(room_rate, room_burst, max_keys)
+        self.latency_threshold = latency_threshold
+        self.max_in_flight = max_in_flight
+        self.smoothing = smoothing
+        self.half_life = half_life
+        self.write_latency = 0.0    # exponential moving average, seconds
+        self._latency_at = time.monotonic()
+        self.in_flight = 0
+        self.rejected = {"sender": 0, "room": 0, "overload": 0}
+
+    def _refuse(self, scope, retry_after, message):
+        self.rejected[scope] += 1
+        raise RateLimitExceeded(scope, retry_after, message)
+
+    def check_overload(self, count=1):
+        """Raise RateLimitExceeded if the database is too slow or busy to take `count` more inserts."""
+        if self.max_in_flight and self.in_flight + count > self.max_in_flight and self.in_flight:
+            self._refuse("overload", 1.0, "Too many messages are being written; retry shortly.")
+        if self.latency_threshold and self.current_latency() > self.latency_threshold:
+            if random.random() > self.latency_threshold / self.write_latency:
+                self._refuse("overload", max(1.0, self.write_latency), "Message storage is overloaded; retry shortly.")
+
+    def acquire(self, sender_id, room_id):
+        """Admit one send or raise RateLimitExceeded. Call finished() after the insert."""
+        now = time.monotonic()
+        sender_wait = self.senders.wait_time(sender_id, now=now)
+        if sender_wait:
+            self._refuse("sender", sender_wait, "You are sending messages too fast.")
+        room_wait = self.rooms.wait_time(room_id, now=now)
+        if room_wait:
+            self._refuse("room", room_wait, "This room is receiving messages too fast.")
+        self.check_overload()
+        self.senders.take(sender_id, now=now)
+        self.rooms.take(room_id, now=now)
+        self.in_flight += 1
+
+    def begin(self, count):
+        """Admit a batch of inserts (overload checks only). Call finished() afterwards."""
+        self.check_overload(count)
+        self.in_flight += count
+
+    def finished(self, count=1):
+        """Admitted inserts are done (successfully or not)."""
+        self.in_flight -= count
+
+    def record_latency(self, seconds):
+        """Feed the average with the duration of one insert statement, queue wait excluded."""
+        self.current_latency()
+        self.write_latency += self.smoothing * (seconds - self.write_latency)
+
+    def current_latency(self):
+        """The moving average, decayed for the time since the last measurement."""
+        now = time.monotonic()
+        if self.half_life and self.write_latency:
+            self.write_latency *= 0.5 ** ((now - self._latency_at) / self.half_life)
+        self._latency_at = now
+        return self.write_latency
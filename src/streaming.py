@@ -0,0 +1,197 @@
+# src/streaming.py
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# python-multipart is importable as python_multipart from 0.0.13 on
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+def dumps(value):
+    """Compact JSON bytes, encoded with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+# ---------------- NDJSON OUT ----------------
+async def encode_ndjson(pages):
+    """One bytes chunk per page of rows, one JSON document per line.
+
+    `pages` is an async iterator of lists; each page is written as soon as it
+    arrives, so only one page is ever held in memory.
+    """
+    async for page in pages:
+        if page:
+            yield b"".join(dumps(row) + b"\n" for row in page)
+
+
+async def gzip_chunks(chunks, level=6):
+    """Compress an async stream of bytes into one gzip member, chunk by chunk."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 16 + 15: gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# ---------------- NDJSON IN ----------------
+async def decode_ndjson(chunks, compressed=None, max_line_bytes=1024 * 1024):
+    """(line number, document) for every non-blank line of an async bytes stream.
+
+    Gzip input is recognised by its magic bytes unless `compressed` says
+    otherwise. Raises ValueError naming the line for anything that is not JSON,
+    or for a line longer than `max_line_bytes`. Compressed input is inflated
+    at most `max_line_bytes` at a time, so neither a gzip bomb nor a missing
+    newline makes memory grow past about twice that.
+    """
+    decompressor = None
+    pending = b""
+    line_number = 0
+    first = True
+    async for chunk in chunks:
+        if first and chunk:
+            first = False
+            if compressed or (compressed is None and chunk[:2] == b"\x1f\x8b"):
+                decompressor = zlib.decompressobj(47)  # 32 + 15: gzip or zlib header
+        if decompressor is None:
+            pieces = (chunk,)
+        else:
+            pieces = _inflate(decompressor, chunk, max_line_bytes)
+        for piece in pieces:
+            lines = (pending + piece).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                line_number += 1
+                if len(line) > max_line_bytes:
+                    raise ValueError(f"Line {line_number}: longer than {max_line_bytes} bytes")
+                if line.strip():
+                    yield line_number, _loads(line, line_number)
+            if len(pending) > max_line_bytes:
+                raise ValueError(f"Line {line_number + 1}: longer than {max_line_bytes} bytes")
+    if decompressor is not None:
+        pending += decompressor.flush()
+    for line in pending.split(b"\n"):
+        line_number += 1
+        if len(line) > max_line_bytes:
+            raise ValueError(f"Line {line_number}: longer than {max_line_bytes} bytes")
+        if line.strip():
+            yield line_number, _loads(line, line_number)
+
+
+def _inflate(decompressor, chunk, max_length):
+    """Output of one compressed chunk, at most max_length bytes per piece."""
+    data = decompressor.decompress(chunk, max_length)
+    while True:
+        yield data
+        if not decompressor.unconsumed_tail:
+            return
+        data = decompressor.decompress(decompressor.unconsumed_tail, max_length)
+
+
+def _loads(line, line_number):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Line {line_number}: invalid JSON ({e})")
+
+
+# ---------------- MULTIPART IN ----------------
+class MultipartFile:
+    """The first file part of a multipart/form-data body, read as it arrives.
+
+    Unlike Request.form(), nothing is spooled: open() parses up to the file
+    part's headers (at most `max_preamble` bytes of other fields and headers
+    may come first), then iterating yields the file's bytes one request chunk
+    at a time. Anything after the file part is never read.
+    """
+
+    def __init__(self, chunks, content_type, max_preamble=64 * 1024):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("Multipart body without a boundary")
+        self._chunks = chunks.__aiter__()
+        self.max_preamble = max_preamble
+        self.filename = None
+        self.content_type = None
+        self._headers = {}
+        self._field = b""
+        self._value = b""
+        self._in_file = False
+        self._found = False
+        self._done = False
+        self._data = []
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        })
+
+    # Parser callbacks
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field, self._value = b"", b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if not self._found and b"filename" in options:
+            self._found = self._in_file = True
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self.content_type = self._headers.get(b"content-type", b"").decode("latin-1") or None
+
+    def _part_data(self, data, start, end):
+        if self._in_file:
+            self._data.append(data[start:end])
+
+    def _part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._done = True
+
+    async def open(self):
+        """Read up to the file part; returns False when the body has none."""
+        consumed = 0
+        while not self._found:
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                return False
+            consumed += len(chunk)
+            self._parser.write(chunk)
+            if not self._found and consumed > self.max_preamble:
+                raise ValueError(f"No file part in the first {self.max_preamble} bytes")
+        return True
+
+    async def __aiter__(self):
+        while True:
+            if self._data:
+                data, self._data = b"".join(self._data), []
+                yield data
+            if self._done:
+                return
+            try:
+                self._parser.write(await self._chunks.__anext__())
+            except StopAsyncIteration:
+                raise ValueError("Multipart body ended inside the file part")